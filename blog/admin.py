@@ -1,5 +1,167 @@
+from collections import Counter
+from datetime import timedelta
+from statistics import median
+
 from django.contrib import admin
-from .models import Post, Comment
+from django.db.models import Sum
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from django.utils.html import format_html
+
+from .analytics import day_start
+from .models import Post, Comment, PostViewBucket, RequestProfile
 
 admin.site.register(Post)
-admin.site.register(Comment)
\ No newline at end of file
+admin.site.register(Comment)
+
+
+# ==============================
+# VIEW ANALYTICS DASHBOARD
+# ==============================
+
+
+@admin.register(PostViewBucket)
+class PostViewBucketAdmin(admin.ModelAdmin):
+    list_display = ("post", "granularity", "bucket_start", "views")
+    list_filter = ("granularity",)
+    list_select_related = ("post",)
+    date_hierarchy = "bucket_start"
+    change_list_template = "admin/blog/postviewbucket/change_list.html"
+
+    def get_urls(self):
+        return [
+            path(
+                "dashboard/",
+                self.admin_site.admin_view(self.dashboard_view),
+                name="blog_postviewbucket_dashboard",
+            ),
+        ] + super().get_urls()
+
+    def dashboard_view(self, request):
+        # Every query is limited to a fixed time window and grouped by
+        # bucket, so the cost doesn't grow with the size of the archive.
+        now = timezone.now()
+        buckets = PostViewBucket.objects.all()
+
+        hour_cutoff = now - timedelta(hours=48)
+        hourly = list(
+            buckets.filter(granularity=PostViewBucket.HOUR, bucket_start__gte=hour_cutoff)
+            .values("bucket_start")
+            .annotate(total=Sum("views"))
+            .order_by("bucket_start")
+        )
+
+        # Daily series: daily rollups plus hourly buckets not compacted yet
+        day_cutoff = day_start(now - timedelta(days=29))
+        daily = Counter()
+        for row in (
+            buckets.filter(bucket_start__gte=day_cutoff)
+            .values("granularity", "bucket_start")
+            .annotate(total=Sum("views"))
+        ):
+            daily[day_start(row["bucket_start"])] += row["total"]
+        daily = [{"day": day, "total": daily[day]} for day in sorted(daily)]
+
+        top_posts = (
+            buckets.filter(bucket_start__gte=now - timedelta(days=7))
+            .values("post_id", "post__title")
+            .annotate(total=Sum("views"))
+            .order_by("-total")[:10]
+        )
+
+        # A spike is an hour with at least 3x the typical hourly traffic
+        typical = median([row["total"] for row in hourly]) if hourly else 0
+        spikes = [
+            row for row in hourly if row["total"] >= max(3 * typical, 10)
+        ]
+
+        peak_hour = max([row["total"] for row in hourly], default=0)
+        peak_day = max([row["total"] for row in daily], default=0)
+        for row in hourly:
+            row["percent"] = 100 * row["total"] // peak_hour if peak_hour else 0
+        for row in daily:
+            row["percent"] = 100 * row["total"] // peak_day if peak_day else 0
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Post views",
+            "hourly": hourly,
+            "daily": daily,
+            "top_posts": top_posts,
+            "spikes": spikes,
+            "typical": typical,
+        }
+        return TemplateResponse(
+            request, "admin/blog/postviewbucket/dashboard.html", context
+        )
+
+
+# ==============================
+# REQUEST PROFILES
+# ==============================
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    # Profiles are only ever written by blog.profiling.ProfilingMiddleware
+    list_display = (
+        "created_at",
+        "method",
+        "path",
+        "url_name",
+        "status_code",
+        "duration_ms",
+        "sql_count",
+        "sql_time_ms",
+        "trigger",
+    )
+    list_filter = ("trigger", "url_name")
+    search_fields = ("path",)
+    fields = (
+        ("created_at", "trigger"),
+        ("method", "path", "url_name", "status_code"),
+        ("duration_ms", "sql_count", "sql_time_ms"),
+        "call_tree_display",
+        "sql_trace_display",
+        "stats_display",
+    )
+    readonly_fields = (
+        "created_at",
+        "trigger",
+        "method",
+        "path",
+        "url_name",
+        "status_code",
+        "duration_ms",
+        "sql_count",
+        "sql_time_ms",
+        "call_tree_display",
+        "sql_trace_display",
+        "stats_display",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def preformatted(self, text):
+        return format_html(
+            '<pre style="font-size: 12px; max-height: 600px; overflow: auto;">{}</pre>',
+            text,
+        )
+
+    @admin.display(description="Call tree")
+    def call_tree_display(self, obj):
+        return self.preformatted(obj.call_tree)
+
+    @admin.display(description="SQL")
+    def sql_trace_display(self, obj):
+        return self.preformatted(obj.sql_trace)
+
+    @admin.display(description="Top functions")
+    def stats_display(self, obj):
+        return self.preformatted(obj.stats)
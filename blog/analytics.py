@@ -0,0 +1,189 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from . import metrics, trending
+from .models import Post, PostViewBucket
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# BATCHED VIEW INGESTION
+# ==============================
+# post_detail only bumps an in-memory counter. Once enough views are pending
+# a background thread writes them to the database in one transaction: hourly
+# PostViewBucket rows, the lifetime Post.views counters and the trending
+# scores. A timer thread per worker flushes whatever is pending every
+# flush_interval seconds, so views of a quiet site don't wait for the next
+# visit, and the rest is flushed when the worker exits.
+
+# Hours and days both follow the site's TIME_ZONE (not UTC), so every hourly
+# bucket falls into exactly one daily bucket, also for zones with a
+# non-whole-hour offset
+
+
+def hour_start(when):
+    return timezone.localtime(when).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(when):
+    return timezone.localtime(when).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_to_buckets(counts, granularity):
+    # Upsert {(post_id, bucket_start): views} with one INSERT and one UPDATE.
+    # Rows are created empty first so the increment is a plain atomic
+    # "views = views + n" and concurrent flushes from other workers add up.
+    if not counts:
+        return
+    PostViewBucket.objects.bulk_create(
+        [
+            PostViewBucket(post_id=post_id, granularity=granularity, bucket_start=start)
+            for post_id, start in counts
+        ],
+        ignore_conflicts=True,
+    )
+    increments = Case(
+        *[
+            When(post_id=post_id, bucket_start=start, then=Value(views))
+            for (post_id, start), views in counts.items()
+        ],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    PostViewBucket.objects.filter(
+        granularity=granularity,
+        post_id__in={post_id for post_id, _ in counts},
+        bucket_start__in={start for _, start in counts},
+    ).update(views=F("views") + increments)
+
+
+def write_view_batch(batch):
+    # batch: Counter of {(post_id, hour_start): views}
+    existing = set(
+        Post.objects.filter(pk__in={post_id for post_id, _ in batch}).values_list(
+            "pk", flat=True
+        )
+    )
+    batch = Counter({key: n for key, n in batch.items() if key[0] in existing})
+    per_post = Counter()
+    for (post_id, _), views in batch.items():
+        per_post[post_id] += views
+    if not per_post:
+        return
+
+    with transaction.atomic():
+        add_to_buckets(batch, PostViewBucket.HOUR)
+        Post.objects.filter(pk__in=per_post).update(
+            views=F("views")
+            + Case(
+                *[When(pk=post_id, then=Value(n)) for post_id, n in per_post.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+    for post_id, views in per_post.items():
+        trending.record_event(post_id, "view", views)
+
+
+class ViewAggregator:
+    def __init__(self, max_pending=200, flush_interval=10):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.last_flush_size = 0
+        self._pending = Counter()
+        self._pending_total = 0
+        self._last_flush = time.monotonic()
+        self._flushing = False
+        self._lock = threading.Lock()
+        self._timer_pid = None
+
+    def record(self, post_id, when=None):
+        key = (post_id, hour_start(when or timezone.now()))
+        with self._lock:
+            self._pending[key] += 1
+            self._pending_total += 1
+            due = self._start_flush(self._pending_total >= self.max_pending)
+            start_timer = self._timer_pid != os.getpid()
+            if start_timer:
+                self._timer_pid = os.getpid()
+        if due:
+            threading.Thread(target=self._flush_in_background, daemon=True).start()
+        if start_timer:
+            # Started on the first view of each process: threads don't
+            # survive a fork, so one started in the master would be lost
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def _start_flush(self, due):
+        # Called with the lock held; True if the caller should flush
+        if due and not self._flushing:
+            self._flushing = True
+            return True
+        return False
+
+    def flush(self):
+        # Write everything pending; returns the number of views written
+        with self._lock:
+            batch, self._pending = self._pending, Counter()
+            total, self._pending_total = self._pending_total, 0
+            self._last_flush = time.monotonic()
+        if not batch:
+            return 0
+        try:
+            write_view_batch(batch)
+        except Exception:
+            # Keep the counts for the next flush rather than losing them
+            with self._lock:
+                self._pending.update(batch)
+                self._pending_total += total
+            raise
+        self.last_flush_size = total
+        metrics.observe("blog_view_buffer_flush_size", total)
+        return total
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing post views failed")
+        finally:
+            self._flushing = False
+            connections.close_all()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self._lock:
+                due = self._start_flush(
+                    self._pending_total > 0
+                    and time.monotonic() - self._last_flush >= self.flush_interval
+                )
+            if due:
+                self._flush_in_background()
+
+    def flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing post views at exit failed")
+
+
+aggregator = ViewAggregator(
+    max_pending=getattr(settings, "VIEW_BUFFER_MAX_PENDING", 200),
+    flush_interval=getattr(settings, "VIEW_BUFFER_FLUSH_INTERVAL", 10),
+)
+
+# Don't lose buffered views when a worker shuts down
+atexit.register(aggregator.flush_at_exit)
+
+
+def record_view(post):
+    aggregator.record(post.pk)
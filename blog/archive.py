@@ -0,0 +1,213 @@
+import re
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ArchiveBucket, Post
+
+# ==============================
+# ARCHIVE INDEX
+# ==============================
+# ArchiveBucket holds the number of published posts per month and per author
+# and the newest post of each (the entry point for keyset pagination). The
+# Post signals (blog/signals.py) move a post between buckets when it is
+# published, edited or removed, so the archive index page is one small query
+# (cached until the next change) and an archive page is one range scan on
+# the (published_date, id) or (author, published_date, id) index.
+# "manage.py rebuild_archive_index" recomputes the table from scratch.
+
+INDEX_CACHE_KEY = "archive:index"
+CURSOR_RE = re.compile(r"^(\d+)-(\d+)$")
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def month_start(when):
+    # Months follow the site's TIME_ZONE, not UTC
+    return timezone.localtime(when).date().replace(day=1)
+
+
+def month_range(month):
+    start = timezone.make_aware(datetime(month.year, month.month, 1))
+    if month.month == 12:
+        end = datetime(month.year + 1, 1, 1)
+    else:
+        end = datetime(month.year, month.month + 1, 1)
+    return start, timezone.make_aware(end)
+
+
+def is_published(published_date):
+    return published_date is not None and published_date <= timezone.now()
+
+
+def bucket_posts(kind, key):
+    posts = Post.objects.filter(published_date__lte=timezone.now())
+    if kind == ArchiveBucket.MONTH:
+        start, end = month_range(key)
+        return posts.filter(published_date__gte=start, published_date__lt=end)
+    return posts.filter(author_id=key)
+
+
+def bucket_filter(kind, key):
+    if kind == ArchiveBucket.MONTH:
+        return {"kind": kind, "month": key}
+    return {"kind": kind, "author_id": key}
+
+
+def bucket_keys(state):
+    # state: (published_date, author_id) of a post, or None
+    if state is None or not is_published(state[0]):
+        return set()
+    published_date, author_id = state
+    return {
+        (ArchiveBucket.MONTH, month_start(published_date)),
+        (ArchiveBucket.AUTHOR, author_id),
+    }
+
+
+def refresh_entry_point(kind, key):
+    newest = (
+        bucket_posts(kind, key)
+        .order_by("-published_date", "-pk")
+        .values_list("published_date", "pk")
+        .first()
+    )
+    ArchiveBucket.objects.filter(**bucket_filter(kind, key)).update(
+        latest_published_date=newest[0] if newest else None,
+        latest_post_id=newest[1] if newest else None,
+    )
+
+
+def adjust_bucket(kind, key, delta):
+    buckets = ArchiveBucket.objects.filter(**bucket_filter(kind, key))
+    if not buckets.update(post_count=F("post_count") + delta) and delta > 0:
+        try:
+            with transaction.atomic():
+                ArchiveBucket.objects.create(
+                    **bucket_filter(kind, key), post_count=delta
+                )
+        except IntegrityError:
+            # Created by a concurrent request meanwhile
+            buckets.update(post_count=F("post_count") + delta)
+    buckets.filter(post_count__lte=0).delete()
+
+
+def post_moved(old, new):
+    # Move a post between buckets; old/new are (published_date, author_id)
+    # before and after the change, None for a new or deleted post
+    if old == new:
+        return
+    old_keys, new_keys = bucket_keys(old), bucket_keys(new)
+    for kind, key in old_keys - new_keys:
+        adjust_bucket(kind, key, -1)
+    for kind, key in new_keys - old_keys:
+        adjust_bucket(kind, key, 1)
+    for kind, key in old_keys | new_keys:
+        refresh_entry_point(kind, key)
+    if old_keys or new_keys:
+        transaction.on_commit(invalidate_archive_index)
+
+
+def rebuild_archive_index():
+    # Full recount in one pass (also fixes drift, e.g. after posts were
+    # changed with queryset.update()); posts come oldest first, so the last
+    # one seen in a bucket is its entry point
+    buckets = {}
+    posts = Post.objects.filter(published_date__lte=timezone.now()).order_by(
+        "published_date", "pk"
+    )
+    for published_date, pk, author_id in posts.values_list(
+        "published_date", "pk", "author_id"
+    ).iterator():
+        for key in bucket_keys((published_date, author_id)):
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = ArchiveBucket(**bucket_filter(*key))
+            bucket.post_count += 1
+            bucket.latest_published_date = published_date
+            bucket.latest_post_id = pk
+    with transaction.atomic():
+        ArchiveBucket.objects.all().delete()
+        ArchiveBucket.objects.bulk_create(buckets.values(), batch_size=500)
+    transaction.on_commit(invalidate_archive_index)
+    return len(buckets)
+
+
+# ==============================
+# CACHED INDEX
+# ==============================
+
+
+def invalidate_archive_index():
+    cache.delete(INDEX_CACHE_KEY)
+
+
+def archive_index():
+    # {"months": [...], "authors": [...]} with counts and entry points,
+    # newest month and most prolific author first
+    index = cache.get(INDEX_CACHE_KEY)
+    if index is None:
+        months, authors = [], []
+        for bucket in ArchiveBucket.objects.select_related("author").order_by(
+            "-month", "-post_count"
+        ):
+            entry = {
+                "count": bucket.post_count,
+                "latest_published_date": bucket.latest_published_date,
+                "latest_post_id": bucket.latest_post_id,
+            }
+            if bucket.kind == ArchiveBucket.MONTH:
+                months.append({"month": bucket.month, **entry})
+            else:
+                authors.append(
+                    {"author_id": bucket.author_id, "username": bucket.author.username, **entry}
+                )
+        index = {"months": months, "authors": authors}
+        cache.set(
+            INDEX_CACHE_KEY, index, getattr(settings, "ARCHIVE_CACHE_TIMEOUT", 86400)
+        )
+    return index
+
+
+# ==============================
+# KEYSET PAGES
+# ==============================
+
+
+def make_cursor(post):
+    # "<published_date in epoch microseconds>-<id>" of the last post shown
+    # (integer arithmetic, so equal dates compare equal after the round trip)
+    micros = (post.published_date - EPOCH) // MICROSECOND
+    return f"{micros}-{post.pk}"
+
+
+def parse_cursor(cursor):
+    # (published_date, id) from a cursor, None if it isn't a valid one
+    match = CURSOR_RE.match(cursor or "")
+    if not match:
+        return None
+    try:
+        return EPOCH + int(match[1]) * MICROSECOND, int(match[2])
+    except OverflowError:
+        return None
+
+
+def page_of_posts(posts, cursor=None):
+    # One page of posts, newest first, after the cursor; returns
+    # (posts, cursor of the next page or None)
+    position = parse_cursor(cursor)
+    if position is not None:
+        published_date, pk = position
+        posts = posts.filter(
+            Q(published_date__lt=published_date)
+            | Q(published_date=published_date, pk__lt=pk)
+        )
+    size = getattr(settings, "ARCHIVE_PAGE_SIZE", 20)
+    page = list(posts.defer("text").order_by("-published_date", "-pk")[: size + 1])
+    next_cursor = make_cursor(page[size - 1]) if len(page) > size else None
+    return page[:size], next_cursor
@@ -0,0 +1,428 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import AutocompleteChange, Post
+
+# ==============================
+# TITLE AUTOCOMPLETE INDEX
+# ==============================
+# Every worker keeps an in-memory prefix index of published post titles:
+#
+# - text: all lower-cased titles joined with "\0";
+# - offsets: the position of every word start in text, sorted by the text
+#   that follows it, so the words matching a prefix form one contiguous
+#   range found with two binary searches;
+# - per title slot: its start in text, post id, views (the ranking weight)
+#   and original title;
+# - top: for every "heavy" prefix (one matching more than HEAVY_PREFIX
+#   words, e.g. "a" or "th") its TOP_K best slots, computed at build time.
+#
+# For 100k titles that's a few MB of str/array data rather than millions of
+# small objects. A lookup is a dict hit for heavy prefixes, otherwise two
+# bisects plus a scan of at most HEAVY_PREFIX words (results for the current
+# index are memoized), so it costs microseconds however many titles match.
+#
+# Building sorts the word starts one two-character bucket at a time, so
+# only the suffix strings of the largest bucket exist at once.
+#
+# Indexes are never modified in place: a change builds a new one, which is
+# swapped in, so lookups need no lock. A post save/delete is written to the
+# AutocompleteChange table in the same transaction; every worker checks the
+# table at most once a second and replays the rows it hasn't applied yet (or
+# rebuilds if the rows were trimmed before it saw them). View counts change
+# constantly without signals, so every AUTOCOMPLETE_REFRESH_INTERVAL seconds
+# a background thread reloads them and recomputes the weights and top lists
+# (the text and offsets are reused). The first build also runs in the
+# background; until it's done, lookups go to the database.
+
+SEP = "\0"
+WORD_START = re.compile(r"\b\w")
+
+LOG_SIZE = 1000
+CHECK_INTERVAL = 1.0
+MEMO_SIZE = 2048
+HEAVY_PREFIX = 64
+TOP_K = 10
+
+
+def normalize(text):
+    return " ".join(text.lower().replace(SEP, " ").split())
+
+
+def sort_offsets(text, words):
+    # Word starts sorted by the text that follows them (up to the end of the
+    # title). Sorting with the full suffixes as keys would hold one string per
+    # word; grouped by their first two characters ("a" + SEP for a one-letter
+    # word, which sorts first), only one group's keys exist at a time.
+    groups = {}
+    for offset in words:
+        prefix = text[offset : offset + 2]
+        group = groups.get(prefix)
+        if group is None:
+            group = groups[prefix] = array("I")
+        group.append(offset)
+    offsets = array("I")
+    for prefix in sorted(groups):
+        offsets.extend(
+            sorted(groups.pop(prefix), key=lambda o: text[o : text.find(SEP, o)])
+        )
+    return offsets
+
+
+class PrefixIndex:
+    def __init__(self, text, starts, post_ids, weights, titles, offsets, top=None):
+        self.text = text
+        self.starts = starts
+        self.post_ids = post_ids
+        self.weights = weights
+        self.titles = titles
+        self.offsets = offsets
+        self.top = top if top is not None else {}
+        self._memo = {}
+
+    @classmethod
+    def build(cls, rows):
+        # rows: (post id, title, views)
+        parts = []
+        starts, post_ids, weights, titles = array("I"), array("I"), array("I"), []
+        words = array("I")  # word start offsets, in text order
+        position = 0
+        for post_id, title, views in rows:
+            key = normalize(title)
+            starts.append(position)
+            post_ids.append(post_id)
+            weights.append(min(views, 2**32 - 1))
+            titles.append(title)
+            words.extend(position + match.start() for match in WORD_START.finditer(key))
+            parts.append(key + SEP)
+            position += len(key) + 1
+        text = "".join(parts)
+        offsets = sort_offsets(text, words)
+        index = cls(text, starts, post_ids, weights, titles, offsets)
+        index.top = index._top_lists(index._heavy_prefixes())
+        return index
+
+    def __len__(self):
+        return len(self.post_ids) - self.post_ids.count(0)
+
+    def _suffix(self, offset):
+        return self.text[offset : self.text.find(SEP, offset)]
+
+    def _slot(self, offset):
+        return bisect_right(self.starts, offset) - 1
+
+    def _rank(self, slot):
+        # Most viewed first, then in build order
+        return (-self.weights[slot], slot)
+
+    def _range(self, key, lo=0, hi=None):
+        # Range of offsets whose text starts with key
+        text, n = self.text, len(key)
+        hi = len(self.offsets) if hi is None else hi
+        lo = bisect_left(self.offsets, key, lo, hi, key=lambda o: text[o : o + n])
+        hi = bisect_right(self.offsets, key, lo, hi, key=lambda o: text[o : o + n])
+        return lo, hi
+
+    def _scan(self, key, limit):
+        lo, hi = self._range(key)
+        slots = {self._slot(self.offsets[i]) for i in range(lo, hi)}
+        return heapq.nsmallest(limit, slots, key=self._rank)
+
+    def _heavy_prefixes(self):
+        # Every prefix matching more than HEAVY_PREFIX words; a prefix of a
+        # heavy prefix is heavy as well, so the search walks down from ""
+        heavy = set()
+        text, offsets = self.text, self.offsets
+        pending = [("", 0, len(offsets))]
+        while pending:
+            prefix, lo, hi = pending.pop()
+            n = len(prefix) + 1
+            i = lo
+            while i < hi:
+                key = text[offsets[i] : offsets[i] + n]
+                if len(key) < n or key.endswith(SEP):
+                    i += 1  # the title ends here
+                    continue
+                j = self._range(key, i, hi)[1]
+                if j - i > HEAVY_PREFIX:
+                    heavy.add(key)
+                    pending.append((key, i, j))
+                i = j
+        return heavy
+
+    def _prefixes(self, slot, heavy):
+        # The heavy prefixes a title matches
+        title = self._suffix(self.starts[slot])
+        found = set()
+        for match in WORD_START.finditer(title):
+            rest = title[match.start() :]
+            for n in range(1, len(rest) + 1):
+                if rest[:n] not in heavy:
+                    break
+                found.add(rest[:n])
+        return found
+
+    def _top_lists(self, heavy):
+        # Visit titles from most to least viewed; the first TOP_K titles
+        # matching a heavy prefix are its top list
+        top = {prefix: [] for prefix in heavy}
+        remaining = len(top)
+        for slot in sorted(range(len(self.post_ids)), key=self._rank):
+            if not remaining:
+                break
+            if not self.post_ids[slot]:
+                continue
+            for prefix in self._prefixes(slot, heavy):
+                slots = top[prefix]
+                if len(slots) < TOP_K:
+                    slots.append(slot)
+                    if len(slots) == TOP_K:
+                        remaining -= 1
+        return top
+
+    def search(self, query, limit=8):
+        # [(post id, title)] of titles with a word starting with query,
+        # most viewed first
+        key = normalize(query)
+        if not key:
+            return []
+        top = self.top.get(key)
+        if top is not None and limit <= TOP_K:
+            return [(self.post_ids[slot], self.titles[slot]) for slot in top[:limit]]
+
+        memo_key = (key, limit)
+        if memo_key in self._memo:
+            return self._memo[memo_key]
+        results = [
+            (self.post_ids[slot], self.titles[slot]) for slot in self._scan(key, limit)
+        ]
+        if len(self._memo) >= MEMO_SIZE:
+            self._memo.clear()
+        self._memo[memo_key] = results
+        return results
+
+    def without(self, post_id):
+        # Copy of the index without post_id (its text stays until the next
+        # rebuild; the slot is marked with id 0)
+        try:
+            slot = self.post_ids.index(post_id)
+        except ValueError:
+            return self
+        start = self.starts[slot]
+        offsets = array("I", self.offsets)
+        for match in WORD_START.finditer(self._suffix(start)):
+            offset = start + match.start()
+            i = bisect_left(offsets, self._suffix(offset), key=self._suffix)
+            while offsets[i] != offset:
+                i += 1
+            del offsets[i]
+        post_ids = array("I", self.post_ids)
+        post_ids[slot] = 0
+        index = PrefixIndex(
+            self.text, self.starts, post_ids, self.weights, self.titles, offsets
+        )
+        index.top = dict(self.top)
+        for prefix in self._prefixes(slot, self.top):
+            slots = self.top[prefix]
+            if slot not in slots:
+                continue
+            if len(slots) < TOP_K:
+                index.top[prefix] = [s for s in slots if s != slot]
+            else:
+                # The next best title isn't known: rescan this prefix
+                index.top[prefix] = index._scan(prefix, TOP_K)
+        return index
+
+    def with_weights(self, views):
+        # Copy of the index ranked by new view counts ({post id: views}); the
+        # text and offsets are shared, weights and top lists are recomputed
+        weights = array(
+            "I",
+            (
+                min(views.get(post_id, weight), 2**32 - 1)
+                for post_id, weight in zip(self.post_ids, self.weights)
+            ),
+        )
+        index = PrefixIndex(
+            self.text, self.starts, self.post_ids, weights, self.titles, self.offsets
+        )
+        index.top = index._top_lists(set(self.top))
+        return index
+
+    def with_post(self, post_id, title, views):
+        # Copy of the index with one more title
+        key = normalize(title)
+        start = len(self.text)
+        text = self.text + key + SEP
+        index = PrefixIndex(
+            text,
+            self.starts + array("I", [start]),
+            self.post_ids + array("I", [post_id]),
+            self.weights + array("I", [min(views, 2**32 - 1)]),
+            self.titles + [title],
+            array("I", self.offsets),
+            dict(self.top),
+        )
+        for match in WORD_START.finditer(key):
+            offset = start + match.start()
+            i = bisect_left(
+                index.offsets, index._suffix(offset), key=index._suffix
+            )
+            index.offsets.insert(i, offset)
+        slot = len(index.post_ids) - 1
+        for prefix in index._prefixes(slot, self.top):
+            index.top[prefix] = sorted(self.top[prefix] + [slot], key=index._rank)[
+                :TOP_K
+            ]
+        return index
+
+
+# ==============================
+# PER-WORKER INDEX
+# ==============================
+
+
+def published_posts():
+    return Post.objects.filter(published_date__lte=timezone.now()).order_by("-views")
+
+
+def published_titles(post_ids=None):
+    posts = published_posts()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    limit = getattr(settings, "AUTOCOMPLETE_MAX_TITLES", 100000)
+    return posts.values_list("pk", "title", "views")[:limit]
+
+
+def search_database(query, limit=8):
+    # Used while a worker's first index is still being built
+    key = normalize(query)
+    if not key:
+        return []
+    posts = published_posts().filter(
+        Q(title__istartswith=key) | Q(title__icontains=" " + key)
+    )
+    return list(posts.values_list("pk", "title")[:limit])
+
+
+class Autocomplete:
+    def __init__(self):
+        self.index = None
+        self.last_change = 0  # id of the last AutocompleteChange applied
+        self.checked_at = 0
+        self.built_at = 0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._rebuilding_lock = threading.Lock()
+
+    def _build(self):
+        # Changes logged from here on are replayed by the next sync
+        last_change = AutocompleteChange.objects.aggregate(last=Max("pk"))["last"]
+        self.index = PrefixIndex.build(published_titles())
+        self.last_change = last_change or 0
+        self.built_at = time.monotonic()
+        return self.index
+
+    def build(self):
+        with self._lock:
+            return self._build()
+
+    def refresh(self):
+        # New view counts for the titles already indexed
+        limit = getattr(settings, "AUTOCOMPLETE_MAX_TITLES", 100000)
+        views = dict(published_posts().values_list("pk", "views")[:limit])
+        with self._lock:
+            self.index = self.index.with_weights(views)
+            self.built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        try:
+            if self.index is None:
+                self.build()
+            else:
+                self.refresh()
+        finally:
+            self._rebuilding = False
+
+    def start_rebuild(self):
+        # First build, or refresh of the view counts, in a background thread
+        with self._rebuilding_lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def sync(self):
+        # Replay changes logged (by any worker) since the last one applied
+        changes = list(
+            AutocompleteChange.objects.filter(pk__gt=self.last_change)
+            .order_by("pk")
+            .values_list("pk", "post_id")
+        )
+        if not changes:
+            return
+        if (
+            changes[0][0] != self.last_change + 1
+            and not AutocompleteChange.objects.filter(pk__lte=self.last_change).exists()
+        ):
+            # Rows we never saw may have been trimmed from the log
+            self._build()
+            return
+        changed = {post_id for _, post_id in changes}
+        index = self.index
+        for post_id in changed:
+            index = index.without(post_id)
+        for row in published_titles(changed):
+            index = index.with_post(*row)
+        self.index = index
+        self.last_change = changes[-1][0]
+
+    def get_index(self):
+        # None until the first build (started in the background) is done
+        if self.index is None:
+            self.start_rebuild()
+            return None
+
+        now = time.monotonic()
+        if now - self.checked_at >= CHECK_INTERVAL and self._lock.acquire(
+            blocking=False
+        ):
+            try:
+                self.checked_at = now
+                self.sync()
+            finally:
+                self._lock.release()
+
+        interval = getattr(settings, "AUTOCOMPLETE_REFRESH_INTERVAL", 600)
+        if now - self.built_at >= interval:
+            self.start_rebuild()
+        return self.index
+
+    def record_change(self, post_id):
+        # Called from the post signals, inside the transaction saving the
+        # post, so the log row exists exactly when the change does
+        change = AutocompleteChange.objects.create(post_id=post_id)
+        AutocompleteChange.objects.filter(pk__lte=change.pk - LOG_SIZE).delete()
+
+    def post_changed(self):
+        # Called once the change is committed: apply it in this worker now
+        if self.index is not None:
+            with self._lock:
+                self.sync()
+
+    def search(self, query, limit=8):
+        index = self.get_index()
+        if index is None:
+            return search_database(query, limit)
+        return index.search(query, limit)
+
+
+autocomplete = Autocomplete()
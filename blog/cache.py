@@ -0,0 +1,253 @@
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.utils import make_template_fragment_key
+
+# ==============================
+# TWO-TIER CACHE BACKEND
+# ==============================
+# A small in-process LRU (tier 1) sits in front of a cache shared by every
+# worker (tier 2, e.g. the file-based or database cache).
+#
+# Every value written to the shared tier carries a random version stamp, and
+# the same stamp is stored under a separate "stamp key". Local copies remember
+# the stamp they were loaded with and only re-check it against the shared tier
+# once every STAMP_CHECK_INTERVAL seconds, so hot keys are served from memory
+# while a set()/delete() in any worker still reaches all the others.
+#
+# Django creates a cache instance per thread (per request context under
+# ASGI), so the local tier and its counters live in LOCAL_TIERS, one per
+# process and shared tier, and all instances use the same one.
+#
+# Example settings:
+#
+#   CACHES = {
+#       "default": {
+#           "BACKEND": "blog.cache.TwoTierCache",
+#           "LOCATION": "shared",  # alias of the shared tier
+#           "OPTIONS": {"LOCAL_MAX_ENTRIES": 500, "LOCAL_TIMEOUT": 60},
+#       },
+#       "shared": {
+#           "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+#           "LOCATION": BASE_DIR / "cache",
+#       },
+#   }
+
+_MISSING = object()
+
+LOCAL_TIERS = {}
+_local_tiers_lock = threading.Lock()
+
+
+class LocalLRU:
+    # Bounded, TTL-limited LRU used as the in-process tier.
+    # Entries are stored pickled (like Django's LocMemCache) so callers can
+    # never mutate a cached object in place.
+
+    def __init__(self, max_entries=500, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Lookups that went on to the shared tier
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # Return (value, stamp, checked_at) or None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[2] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            pickled, stamp, _expires, checked_at = entry
+        return pickle.loads(pickled), stamp, checked_at
+
+    def set(self, key, value, stamp, timeout=None):
+        now = time.monotonic()
+        ttl = self.timeout if timeout is None else min(timeout, self.timeout)
+        if ttl <= 0:
+            self.delete(key)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (pickled, stamp, now + ttl, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def count_shared(self, hit):
+        with self._lock:
+            if hit:
+                self.shared_hits += 1
+            else:
+                self.shared_misses += 1
+
+    def mark_checked(self, key):
+        # The stamp was confirmed against the shared tier just now
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = entry[:3] + (time.monotonic(),)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def local_tier(location, max_entries, timeout):
+    # The process-wide LocalLRU in front of the shared tier `location`
+    with _local_tiers_lock:
+        tier = LOCAL_TIERS.get(location)
+        if tier is None:
+            tier = LOCAL_TIERS[location] = LocalLRU(max_entries, timeout)
+        return tier
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = location or "shared"
+        self._check_interval = options.get("STAMP_CHECK_INTERVAL", 1.0)
+        self.local = local_tier(
+            self._shared_alias,
+            max_entries=options.get("LOCAL_MAX_ENTRIES", 500),
+            timeout=options.get("LOCAL_TIMEOUT", 60),
+        )
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    # Keys in the shared tier are passed through unchanged (the shared backend
+    # applies its own prefix/version); local keys use this backend's make_key.
+
+    def _stamp_key(self, key):
+        return f"{key}:stamp"
+
+    def _local_timeout(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return None
+        return max(timeout - time.time(), 0)
+
+    def _load(self, key, version):
+        # Fetch (stamp, value) from the shared tier and cache it locally
+        entry = self.shared.get(key, _MISSING, version=version)
+        local_key = self.make_and_validate_key(key, version=version)
+        self.local.count_shared(entry is not _MISSING)
+        if entry is _MISSING:
+            return _MISSING
+        stamp, value = entry
+        self.local.set(local_key, value, stamp)
+        return value
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        entry = self.local.get(local_key)
+        if entry is not None:
+            value, stamp, checked_at = entry
+            if time.monotonic() - checked_at < self._check_interval:
+                return value
+            # Cheap revalidation: only the stamp travels, not the value
+            if self.shared.get(self._stamp_key(key), version=version) == stamp:
+                self.local.mark_checked(local_key)
+                return value
+            self.local.delete(local_key)
+        value = self._load(key, version)
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        stamp = uuid.uuid4().hex
+        # Value first, then stamp: a reader that sees the new stamp can only
+        # ever load the new value.
+        self.shared.set(key, (stamp, value), timeout, version=version)
+        self.shared.set(self._stamp_key(key), stamp, timeout, version=version)
+        self.local.set(local_key, value, stamp, self._local_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        stamp = uuid.uuid4().hex
+        if not self.shared.add(key, (stamp, value), timeout, version=version):
+            return False
+        self.shared.set(self._stamp_key(key), stamp, timeout, version=version)
+        self.local.set(local_key, value, stamp, self._local_timeout(timeout))
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.make_and_validate_key(key, version=version)
+        self.shared.touch(self._stamp_key(key), timeout, version=version)
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.local.delete(local_key)
+        # Removing the stamp invalidates every other worker's local copy
+        self.shared.delete(self._stamp_key(key), version=version)
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def stats(self):
+        # Hit/miss counters of this worker (all threads), used for monitoring
+        return {
+            "local_hits": self.local.hits,
+            "local_misses": self.local.misses,
+            "local_evictions": self.local.evictions,
+            "local_entries": len(self.local),
+            "shared_hits": self.local.shared_hits,
+            "shared_misses": self.local.shared_misses,
+        }
+
+
+# ==============================
+# HOMEPAGE FRAGMENT
+# ==============================
+
+# Name of the {% cache %} fragment wrapping the post cards in post_list.html.
+# It varies on whether the visitor is logged in (comment counts differ).
+HOMEPAGE_FRAGMENT = "post_list_cards"
+# The "Popular now" list next to it (the same for every visitor)
+POPULAR_FRAGMENT = "post_list_popular"
+
+
+def invalidate_homepage():
+    cache = caches["default"]
+    cache.delete_many(
+        [
+            make_template_fragment_key(HOMEPAGE_FRAGMENT, [is_authenticated])
+            for is_authenticated in (True, False)
+        ]
+        + [make_template_fragment_key(POPULAR_FRAGMENT)]
+    )
@@ -0,0 +1,208 @@
+import hashlib
+import html
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.db.models import F, Max
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.http import http_date
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from . import metrics
+from .models import Post
+
+# ==============================
+# SITEMAP AND FEEDS
+# ==============================
+# sitemap.xml, the Atom feed and the RSS feed are generated from a few small
+# columns (title, summary, dates, author) - never from the rich text - and
+# cached as finished documents with their ETag and Last-Modified. Saving or
+# deleting a published post drops only the documents it appears in (see
+# blog/signals.py), so crawlers and feed readers are answered from the cache
+# and get 304s between changes.
+#
+# The sitemap is split by post id: sitemap-<n>.xml lists published posts with
+# ids in [n * SITEMAP_PAGE_SIZE, (n + 1) * SITEMAP_PAGE_SIZE), so editing a
+# post only regenerates its own page (and the index).
+
+FEED_TITLE = "Django Girls blog"
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+FEED_FORMATS = {"atom": Atom1Feed, "rss": Rss201rev2Feed}
+SCHEMES = ("http", "https")
+
+
+def published_posts():
+    return Post.objects.filter(published_date__lte=timezone.now())
+
+
+def page_size():
+    return getattr(settings, "SITEMAP_PAGE_SIZE", 5000)
+
+
+def cache_key(document, scheme):
+    return f"feeds:{document}:{scheme}"
+
+
+def invalidate_feeds(post_id=None):
+    # Drop the cached documents a post appears in (all of them without post_id)
+    documents = ["sitemap", *FEED_FORMATS]
+    if post_id is not None:
+        documents.append(f"sitemap-{post_id // page_size()}")
+    cache.delete_many(
+        [cache_key(document, scheme) for document in documents for scheme in SCHEMES]
+    )
+
+
+def cached_document(request, document, build):
+    # build(origin) -> (content bytes, content type, last modified datetime)
+    scheme = "https" if request.is_secure() else "http"
+    key = cache_key(document, scheme)
+    entry = cache.get(key)
+    metrics.increment(
+        "blog_document_cache_requests_total",
+        result="miss" if entry is None else "hit",
+    )
+    if entry is None:
+        origin = f"{scheme}://{get_current_site(request).domain}"
+        content, content_type, last_modified = build(origin)
+        etag = f'"{hashlib.md5(content).hexdigest()}"'
+        last_modified = last_modified.timestamp() if last_modified else None
+        entry = (content, content_type, etag, last_modified)
+        cache.set(key, entry, getattr(settings, "FEEDS_CACHE_TIMEOUT", 3600))
+    content, content_type, etag, last_modified = entry
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = HttpResponse(content, content_type=content_type)
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = "public, max-age=300"
+    return response
+
+
+# ==============================
+# SITEMAP
+# ==============================
+
+
+def write_sitemap(urls, root_tag, entry_tag):
+    # urls: (loc, lastmod) pairs
+    output = StringIO()
+    xml = SimplerXMLGenerator(output, "utf-8")
+    xml.startDocument()
+    xml.startElement(root_tag, {"xmlns": SITEMAP_NS})
+    for loc, lastmod in urls:
+        xml.startElement(entry_tag, {})
+        xml.addQuickElement("loc", loc)
+        if lastmod:
+            xml.addQuickElement("lastmod", lastmod.isoformat(timespec="seconds"))
+        xml.endElement(entry_tag)
+    xml.endElement(root_tag)
+    xml.endDocument()
+    return output.getvalue().encode()
+
+
+def build_sitemap_index(origin):
+    # One aggregate query: the non-empty pages and their newest change
+    size = page_size()
+    pages = (
+        published_posts()
+        .annotate(page=F("pk") / size)
+        .order_by("page")
+        .values("page")
+        .annotate(lastmod=Max("updated_date"))
+        .values_list("page", "lastmod")
+    )
+    urls = [
+        (origin + reverse("sitemap_page", args=[page]), lastmod)
+        for page, lastmod in pages
+    ]
+    content = write_sitemap(urls, "sitemapindex", "sitemap")
+    return content, "application/xml", max((u[1] for u in urls), default=None)
+
+
+def build_sitemap_page(page, origin):
+    size = page_size()
+    posts = list(
+        published_posts()
+        .filter(pk__gte=page * size, pk__lt=(page + 1) * size)
+        .order_by("pk")
+        .values_list("pk", "updated_date")
+    )
+    if not posts:
+        raise Http404("Sitemap page not found")
+    urls = [
+        (origin + reverse("post_detail", args=[pk]), updated)
+        for pk, updated in posts
+    ]
+    content = write_sitemap(urls, "urlset", "url")
+    return content, "application/xml", max(updated for _, updated in posts)
+
+
+def sitemap_index(request):
+    return cached_document(request, "sitemap", build_sitemap_index)
+
+
+def sitemap_page(request, page):
+    return cached_document(
+        request, f"sitemap-{page}", lambda origin: build_sitemap_page(page, origin)
+    )
+
+
+# ==============================
+# ATOM / RSS FEEDS
+# ==============================
+
+
+def build_feed(feed_format, origin):
+    feed_class = FEED_FORMATS[feed_format]
+    posts = list(
+        published_posts()
+        .select_related("author")
+        .only(
+            "pk",
+            "title",
+            "summary",
+            "published_date",
+            "updated_date",
+            "author__username",
+        )
+        .order_by("-published_date")[: getattr(settings, "FEED_ITEMS", 20)]
+    )
+    feed = feed_class(
+        title=FEED_TITLE,
+        link=origin + reverse("post_list"),
+        description=f"Latest posts from {FEED_TITLE}",
+        feed_url=origin + reverse(f"feed_{feed_format}"),
+        language=settings.LANGUAGE_CODE,
+    )
+    for post in posts:
+        link = origin + reverse("post_detail", args=[post.pk])
+        feed.add_item(
+            title=post.title,
+            link=link,
+            unique_id=link,
+            # The summary is stripped HTML that may still contain entities
+            description=html.unescape(post.summary),
+            author_name=post.author.username,
+            pubdate=post.published_date,
+            updateddate=post.updated_date,
+        )
+    content = feed.writeString("utf-8").encode()
+    last_modified = max((post.updated_date for post in posts), default=None)
+    return content, feed.content_type, last_modified
+
+
+def feed(request, feed_format):
+    return cached_document(
+        request, feed_format, lambda origin: build_feed(feed_format, origin)
+    )
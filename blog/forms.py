@@ -1,4 +1,5 @@
 from django import forms
+from django.utils import timezone
 from .models import Post, Comment
 from django.contrib.auth.forms import SetPasswordForm
 
@@ -11,7 +12,26 @@ class PostForm(forms.ModelForm):
 
     class Meta:
         model = Post
-        fields = ("title", "text", "image")
+        fields = ("title", "text", "image", "scheduled_date")
+        labels = {"scheduled_date": "Publish at"}
+        widgets = {
+            "scheduled_date": forms.DateTimeInput(
+                attrs={"type": "datetime-local"}, format="%Y-%m-%dT%H:%M"
+            ),
+        }
+
+    def clean_scheduled_date(self):
+        # Only drafts can be scheduled, and only for the future
+        scheduled_date = self.cleaned_data.get("scheduled_date")
+        if self.instance.published_date:
+            return None
+        if (
+            scheduled_date
+            and "scheduled_date" in self.changed_data
+            and scheduled_date <= timezone.now()
+        ):
+            raise forms.ValidationError("Choose a time in the future.")
+        return scheduled_date
 
 
 # ------------------------------
@@ -0,0 +1,53 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from blog.analytics import add_to_buckets, day_start
+from blog.models import PostViewBucket
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold hourly post view buckets older than --keep-days into daily "
+        "buckets. Run daily (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=2,
+            help="Keep hourly resolution for this many days (default: 2).",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = day_start(timezone.now() - timedelta(days=options["keep_days"]))
+        hourly = PostViewBucket.objects.filter(
+            granularity=PostViewBucket.HOUR, bucket_start__lt=cutoff
+        ).order_by("pk")
+        folded = 0
+
+        while True:
+            # Work in bounded batches so memory and transaction size stay small
+            rows = list(
+                hourly.values_list("pk", "post_id", "bucket_start", "views")[
+                    : options["batch_size"]
+                ]
+            )
+            if not rows:
+                break
+            daily = Counter()
+            for _, post_id, start, views in rows:
+                daily[(post_id, day_start(start))] += views
+            with transaction.atomic():
+                add_to_buckets(daily, PostViewBucket.DAY)
+                PostViewBucket.objects.filter(pk__in=[row[0] for row in rows]).delete()
+            folded += len(rows)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Folded {folded} hourly buckets into daily buckets.")
+        )
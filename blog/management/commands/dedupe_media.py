@@ -0,0 +1,126 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.models import MediaBlob, Post
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold duplicate files in MEDIA_ROOT into one file per content digest: "
+        "references in Post.image and Post.text are pointed at the kept copy, "
+        "the other copies are deleted and every file gets a MediaBlob row so "
+        "future uploads are deduplicated against it. Existing reference "
+        "counts are kept and the folded copies are added to them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be changed.",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        root = str(settings.MEDIA_ROOT)
+
+        # Every file is hashed (not only likely duplicates) so that each
+        # one gets a MediaBlob row for future uploads to match against
+        by_digest = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for filename in filenames:
+                if filename.startswith("."):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, root).replace(os.sep, "/")
+                entry = by_digest.setdefault(
+                    file_digest(path), (os.path.getsize(path), [])
+                )
+                entry[1].append(name)
+
+        # Merge into the existing rows: their refcounts count uploads made
+        # through the storage and must survive, or deleting one of those
+        # uploads would remove a file that other posts still use
+        existing = MediaBlob.objects.in_bulk(list(by_digest), field_name="digest")
+        folded = 0
+        blobs = []
+        removed = []
+        for digest, (size, names) in by_digest.items():
+            blob = existing.get(digest)
+            if blob is not None and blob.name in names:
+                # The stored copy stays; each other copy adds a reference
+                keep = blob.name
+                refcount = blob.refcount + len(names) - 1
+            else:
+                # Keep the original upload, e.g. 1.avif rather than 1_VNqwwZN.avif
+                names.sort(key=lambda name: (len(name), name))
+                keep = names[0]
+                refcount = len(names) + (blob.refcount if blob is not None else 0)
+            if blob is None:
+                blob = MediaBlob(digest=digest)
+            blob.name, blob.size, blob.refcount = keep, size, refcount
+            blobs.append(blob)
+            for duplicate in names:
+                if duplicate == keep:
+                    continue
+                self.stdout.write(f"{duplicate} -> {keep}")
+                removed.append((duplicate, keep))
+                folded += 1
+
+        if not dry_run:
+            on_disk = {
+                name: digest for digest, (_, names) in by_digest.items() for name in names
+            }
+            with transaction.atomic():
+                # Rows for names whose content has changed since
+                stale = [
+                    blob.pk
+                    for blob in MediaBlob.objects.filter(name__in=list(on_disk))
+                    if on_disk[blob.name] != blob.digest
+                ]
+                MediaBlob.objects.filter(pk__in=stale).delete()
+                for blob in blobs:
+                    blob.save()
+                for duplicate, keep in removed:
+                    self.repoint(duplicate, keep)
+                # Files go only once the references to them are committed
+                transaction.on_commit(lambda: self.remove_files(root, removed))
+
+        verb = "Would fold" if dry_run else "Folded"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {folded} duplicate files; {len(blobs)} distinct files."
+            )
+        )
+
+    def remove_files(self, root, removed):
+        for duplicate, _ in removed:
+            try:
+                os.remove(os.path.join(root, duplicate))
+            except FileNotFoundError:
+                pass
+
+    def repoint(self, old, new):
+        # Post.image stores the name, Post.text contains the media URL
+        # (saved one by one so the media reference index follows)
+        for post in Post.objects.filter(image=old):
+            post.image = new
+            post.save(update_fields=["image"])
+        old_url = settings.MEDIA_URL + old
+        new_url = settings.MEDIA_URL + new
+        for post in Post.objects.filter(text__contains=old_url):
+            post.text = post.text.replace(old_url, new_url)
+            post.save(update_fields=["text"])
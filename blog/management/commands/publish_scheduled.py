@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from blog.scheduler import next_scheduled, publish_due_posts
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish drafts whose scheduled_date has passed. Runs until stopped, "
+        "waking up exactly when the next post is due (or every --interval "
+        "seconds to pick up newly scheduled posts); use --once from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Publish the posts that are due now and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=15,
+            help="Longest sleep between checks in seconds (default: 15).",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        while True:
+            for post in publish_due_posts(batch_size=options["batch_size"]):
+                self.stdout.write(f"Published #{post.pk} {post.title}")
+            if options["once"]:
+                return
+
+            sleep = options["interval"]
+            upcoming = next_scheduled()
+            if upcoming is not None:
+                sleep = min(sleep, (upcoming - timezone.now()).total_seconds())
+            # Don't hold a database connection while idle
+            connections.close_all()
+            time.sleep(max(sleep, 0.05))
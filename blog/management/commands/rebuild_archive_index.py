@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from blog.archive import rebuild_archive_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the per-month and per-author archive buckets from the posts. "
+        "The buckets are kept up to date by the post signals; run this after "
+        "changing posts with queryset.update() or raw SQL, or to correct drift."
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild_archive_index()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} archive buckets."))
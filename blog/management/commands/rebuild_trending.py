@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from blog.models import Comment, CommentReaction, PostViewBucket, TrendingScore
+from blog.trending import event_score, half_life_seconds, log_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the trending posts table from comments, reactions and views. "
+        "Run periodically (e.g. nightly from cron) to correct any drift in the "
+        "incrementally updated scores."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--half-lives",
+            type=int,
+            default=10,
+            help="Ignore events older than this many half-lives (default: 10).",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=half_life_seconds() * options["half_lives"])
+        scores = {}
+
+        def add(post_id, kind, when, count=1):
+            if count <= 0:
+                return
+            value = event_score(kind, when, count)
+            current = scores.get(post_id)
+            scores[post_id] = value if current is None else log_add(current, value)
+
+        # Stream the events instead of loading model instances
+        comments = Comment.objects.filter(created_date__gte=cutoff).values_list(
+            "post_id", "created_date"
+        )
+        for post_id, created in comments.iterator():
+            add(post_id, "comment", created)
+
+        reactions = CommentReaction.objects.filter(created_at__gte=cutoff).values_list(
+            "comment__post_id", "created_at"
+        )
+        for post_id, created in reactions.iterator():
+            add(post_id, "reaction", created)
+
+        # Hourly/daily view rollups written by blog/analytics.py
+        buckets = PostViewBucket.objects.filter(bucket_start__gte=cutoff).values_list(
+            "post_id", "bucket_start", "views"
+        )
+        for post_id, start, views in buckets.iterator():
+            add(post_id, "view", start, views)
+
+        rows = [
+            TrendingScore(post_id=post_id, score=score)
+            for post_id, score in scores.items()
+        ]
+        with transaction.atomic():
+            TrendingScore.objects.all().delete()
+            TrendingScore.objects.bulk_create(rows, batch_size=500)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt trending scores for {len(rows)} posts.")
+        )
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.media_index import (
+    find_orphans,
+    quarantine_root,
+    rebuild_references,
+    remove_orphans,
+    scan_media,
+)
+from blog.models import MediaDirectory, Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Find files in MEDIA_ROOT that no post references (Post.image or a "
+        "src/href URL in Post.text) and delete or quarantine them. Only "
+        "directories changed since the last run are listed again. Without "
+        "--delete or --quarantine the orphans are only reported."
+    )
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument(
+            "--delete", action="store_true", help="Delete orphaned files."
+        )
+        action.add_argument(
+            "--quarantine",
+            action="store_true",
+            help="Move orphaned files to MEDIA_QUARANTINE_ROOT.",
+        )
+        parser.add_argument(
+            "--grace-hours",
+            type=float,
+            default=24,
+            help="Leave files modified within this many hours (default: 24).",
+        )
+        parser.add_argument(
+            "--reindex",
+            action="store_true",
+            help="Rebuild the post reference index before sweeping.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options["grace_hours"] < 0:
+            raise CommandError("--grace-hours must not be negative.")
+
+        # The reference index is built in full on the first run
+        if options["reindex"] or not MediaDirectory.objects.exists():
+            count = rebuild_references(Post.objects.all())
+            self.stdout.write(f"Indexed {count} media references.")
+
+        checked, listed = scan_media()
+        self.stdout.write(f"Checked {checked} directories, listed {listed}.")
+
+        remove = options["delete"] or options["quarantine"]
+        found = 0
+        for names in find_orphans(
+            options["grace_hours"] * 3600, batch_size=options["batch_size"]
+        ):
+            found += len(names)
+            if remove:
+                remove_orphans(names, quarantine=options["quarantine"])
+            elif options["verbosity"] > 1:
+                for name in names:
+                    self.stdout.write(name)
+
+        if options["delete"]:
+            message = f"Deleted {found} orphaned files."
+        elif options["quarantine"]:
+            message = f"Moved {found} orphaned files to {quarantine_root()}."
+        else:
+            message = f"Found {found} orphaned files (use --delete or --quarantine)."
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,240 @@
+import os
+import re
+import shutil
+import time
+from datetime import timedelta
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MediaBlob, MediaDirectory, MediaFile, MediaReference
+
+# ==============================
+# ORPHANED MEDIA INDEX
+# ==============================
+# Two indexes are diffed by "manage.py sweep_media":
+#
+# - MediaReference: files used by posts, updated by a post_save signal
+#   (blog/signals.py) so the sweeper never has to parse every post.
+# - MediaFile/MediaDirectory: files found in MEDIA_ROOT. A directory's mtime
+#   changes whenever an entry is added, removed or renamed in it, so only
+#   directories whose mtime differs from the stored checkpoint are listed
+#   again; the others cost a single stat() call.
+
+def quarantine_root():
+    # Outside MEDIA_ROOT: quarantined files must not be served any more
+    return str(
+        getattr(settings, "MEDIA_QUARANTINE_ROOT", None)
+        or f"{str(settings.MEDIA_ROOT).rstrip(os.sep)}-quarantine"
+    )
+
+
+URL_ATTR_RE = re.compile(r"""\b(?:src|href)\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+
+# ckeditor_uploader stores a "<name>_thumb<ext>" next to uploaded images
+THUMB_RE = re.compile(r"^(?P<base>.+)_thumb(?P<ext>\.[^./]+)$")
+
+
+def media_name(url):
+    # "/media/uploads/a.png" or "https://host/media/uploads/a.png"
+    # -> "uploads/a.png"; None for URLs outside MEDIA_URL
+    path = unquote(urlsplit(url).path)
+    media_path = urlsplit(settings.MEDIA_URL).path
+    if not path.startswith(media_path):
+        return None
+    name = path[len(media_path) :].lstrip("/")
+    return name or None
+
+
+def referenced_names(post):
+    names = set()
+    if post.image:
+        names.add(post.image.name)
+    for url in URL_ATTR_RE.findall(post.text or ""):
+        name = media_name(url)
+        if name:
+            names.add(name)
+    return names
+
+
+def update_references(post):
+    names = referenced_names(post)
+    existing = set(
+        MediaReference.objects.filter(post=post).values_list("name", flat=True)
+    )
+    if names == existing:
+        return
+    with transaction.atomic():
+        MediaReference.objects.filter(post=post, name__in=existing - names).delete()
+        MediaReference.objects.bulk_create(
+            [MediaReference(post=post, name=name) for name in names - existing],
+            ignore_conflicts=True,
+        )
+
+
+def rebuild_references(posts, batch_size=500):
+    # Full rebuild, e.g. after posts were changed with queryset.update()
+    count = 0
+    with transaction.atomic():
+        MediaReference.objects.all().delete()
+        batch = []
+        for post in posts.only("pk", "image", "text").iterator(chunk_size=batch_size):
+            batch.extend(
+                MediaReference(post=post, name=name)
+                for name in referenced_names(post)
+            )
+            if len(batch) >= batch_size:
+                count += len(MediaReference.objects.bulk_create(batch))
+                batch = []
+        count += len(MediaReference.objects.bulk_create(batch))
+    return count
+
+
+def scan_media(root=None):
+    # Bring MediaFile/MediaDirectory up to date; returns
+    # (directories checked, directories listed)
+    root = str(root or settings.MEDIA_ROOT)
+    known = {d.path: d for d in MediaDirectory.objects.all()}
+    children = {}
+    for directory in known.values():
+        children.setdefault(directory.parent, []).append(directory.path)
+
+    seen = set()
+    listed = 0
+    stack = [("", None)]
+    while stack:
+        path, parent = stack.pop()
+        try:
+            mtime_ns = os.stat(os.path.join(root, path)).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        seen.add(path)
+        checkpoint = known.get(path)
+        if checkpoint is not None and checkpoint.mtime_ns == mtime_ns:
+            stack.extend((child, path) for child in children.get(path, ()))
+            continue
+
+        # The mtime is read before listing: a file added meanwhile changes
+        # it again, so the directory is simply listed on the next run
+        files, subdirs = list_directory(root, path)
+        sync_directory(path, files)
+        MediaDirectory.objects.update_or_create(
+            path=path, defaults={"parent": parent, "mtime_ns": mtime_ns}
+        )
+        stack.extend((subdir, path) for subdir in subdirs)
+        listed += 1
+
+    gone = set(known) - seen
+    if gone:
+        with transaction.atomic():
+            MediaFile.objects.filter(directory__in=gone).delete()
+            MediaDirectory.objects.filter(path__in=gone).delete()
+    return len(seen), listed
+
+
+def list_directory(root, path):
+    files = {}
+    subdirs = []
+    with os.scandir(os.path.join(root, path)) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            name = f"{path}/{entry.name}" if path else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(name)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                files[name] = (stat.st_size, stat.st_mtime)
+    return files, subdirs
+
+
+def sync_directory(path, files):
+    indexed = {
+        name: (size, mtime)
+        for name, size, mtime in MediaFile.objects.filter(directory=path).values_list(
+            "name", "size", "mtime"
+        )
+    }
+    with transaction.atomic():
+        MediaFile.objects.filter(name__in=indexed.keys() - files.keys()).delete()
+        MediaFile.objects.bulk_create(
+            [
+                MediaFile(name=name, directory=path, size=size, mtime=mtime)
+                for name, (size, mtime) in files.items()
+                if name not in indexed
+            ],
+            batch_size=500,
+        )
+        MediaFile.objects.bulk_update(
+            [
+                MediaFile(name=name, directory=path, size=size, mtime=mtime)
+                for name, (size, mtime) in files.items()
+                if name in indexed and indexed[name] != (size, mtime)
+            ],
+            ["size", "mtime"],
+            batch_size=500,
+        )
+
+
+def find_orphans(grace_seconds, batch_size=1000):
+    # Yield lists of unreferenced MediaFile names older than the grace
+    # period (so uploads whose post is not saved yet are left alone). An
+    # upload deduplicated onto an existing file doesn't change the file, so
+    # for stored uploads the grace period counts from MediaBlob.referenced_at.
+    recently_uploaded = MediaBlob.objects.filter(
+        referenced_at__gte=timezone.now() - timedelta(seconds=grace_seconds)
+    ).values("name")
+    candidates = (
+        MediaFile.objects.filter(mtime__lt=time.time() - grace_seconds)
+        .exclude(name__in=MediaReference.objects.values("name"))
+        .exclude(name__in=recently_uploaded)
+        .order_by("name")
+        .values_list("name", flat=True)
+    )
+    after = ""
+    while True:
+        names = list(candidates.filter(name__gt=after)[:batch_size])
+        if not names:
+            return
+        after = names[-1]
+        # A thumbnail is kept as long as its image is used
+        originals = {}
+        for name in names:
+            match = THUMB_RE.match(name)
+            if match:
+                originals[name] = match["base"] + match["ext"]
+        used = set(
+            MediaReference.objects.filter(name__in=originals.values()).values_list(
+                "name", flat=True
+            )
+        )
+        orphans = [name for name in names if originals.get(name) not in used]
+        if orphans:
+            yield orphans
+
+
+def remove_orphans(names, quarantine=False, root=None):
+    # Delete (or move to MEDIA_QUARANTINE_ROOT, keeping their relative path)
+    # one batch of orphans and drop them from the indexes; returns the number
+    # of files removed
+    root = str(root or settings.MEDIA_ROOT)
+    removed = []
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            if quarantine:
+                target = os.path.join(quarantine_root(), name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        removed.append(name)
+    with transaction.atomic():
+        MediaFile.objects.filter(name__in=removed).delete()
+        # Future uploads of the same content must not reuse a removed name
+        MediaBlob.objects.filter(name__in=removed).delete()
+    return len(removed)
@@ -0,0 +1,349 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no retiring of dead workers' files, see below
+    fcntl = None
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .ratelimit import client_ip
+
+# ==============================
+# METRICS REGISTRY
+# ==============================
+# Counters and histograms are kept in memory per worker; recording is a dict
+# update under a lock held for a few microseconds. At most every
+# METRICS_FLUSH_INTERVAL seconds a worker writes its totals to
+# METRICS_DIR/<pid>-<start time>.json (so a reused pid never overwrites an
+# older worker's file), and /metrics/ sums the files of all workers into the
+# Prometheus text format.
+#
+# The files of workers that have exited are folded into retired.json rather
+# than deleted, so the summed counters never go down when a worker is
+# restarted. METRICS_DIR must be local to the host (liveness is checked by
+# pid).
+#
+# Metric names and labels:
+#   blog_http_requests_total{view, method, status}
+#   blog_http_request_duration_seconds{view}     histogram
+#   blog_db_queries_per_request{view}            histogram
+#   blog_session_writes_total
+#   blog_cache_requests_total{tier, result}      default cache (fragments)
+#   blog_document_cache_requests_total{result}   sitemap/feed documents
+#   blog_view_buffer_flush_size                  histogram
+
+COUNTERS = {
+    "blog_http_requests_total": "Requests by view, method and status code.",
+    "blog_session_writes_total": "Requests that saved the session.",
+    "blog_cache_requests_total": "Default cache lookups by tier and result.",
+    "blog_document_cache_requests_total": "Sitemap and feed cache lookups.",
+}
+
+HISTOGRAMS = {
+    "blog_http_request_duration_seconds": (
+        "Request latency by view.",
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    "blog_db_queries_per_request": (
+        "Database queries per request by view.",
+        (0, 1, 2, 5, 10, 20, 50, 100),
+    ),
+    "blog_view_buffer_flush_size": (
+        "Post views written per view buffer flush.",
+        (1, 10, 50, 100, 200, 500, 1000),
+    ),
+}
+
+
+class Registry:
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf, sum]
+        self._lock = threading.Lock()
+        self._written_at = 0
+        self._pid = None
+        self.key = None
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        bounds = HISTOGRAMS[name][1]
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(bounds, value)
+        with self._lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(bounds) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                [name, dict(labels), value]
+                for (name, labels), value in self.counters.items()
+            ]
+            histograms = [
+                [name, dict(labels), list(values)]
+                for (name, labels), values in self.histograms.items()
+            ]
+        # Cache counters are kept by the cache backend itself (TwoTierCache);
+        # they are per process, so any thread's instance (also the one of the
+        # atexit write) reports the same totals
+        stats = getattr(caches["default"], "stats", None)
+        if stats is not None:
+            stats = stats()
+            for tier in ("local", "shared"):
+                for result, field in (("hit", "hits"), ("miss", "misses")):
+                    counters.append(
+                        [
+                            "blog_cache_requests_total",
+                            {"tier": tier, "result": result},
+                            stats[f"{tier}_{field}"],
+                        ]
+                    )
+        return {"counters": counters, "histograms": histograms}
+
+    def write(self, force=False):
+        # Publish this worker's totals for /metrics/ (at most once per
+        # METRICS_FLUSH_INTERVAL unless forced)
+        directory = getattr(settings, "METRICS_DIR", None)
+        if not directory:
+            return
+        now = time.monotonic()
+        interval = getattr(settings, "METRICS_FLUSH_INTERVAL", 5)
+        with self._lock:
+            if not force and now - self._written_at < interval:
+                return
+            self._written_at = now
+        if self._pid != os.getpid():
+            # First write of this process (a forked worker gets its own key)
+            self._pid = os.getpid()
+            self.key = f"{self._pid}-{time.time_ns()}"
+        os.makedirs(directory, exist_ok=True)
+        write_json(os.path.join(directory, f"{self.key}.json"), self.snapshot())
+
+
+registry = Registry()
+increment = registry.increment
+observe = registry.observe
+atexit.register(registry.write, force=True)
+
+
+# ==============================
+# REQUEST METRICS MIDDLEWARE
+# ==============================
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    # Outermost middleware, so the timing covers the whole stack and the
+    # session has been saved by the time the response comes back
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        increment(
+            "blog_http_requests_total",
+            view=view,
+            method=request.method,
+            status=str(response.status_code),
+        )
+        observe("blog_http_request_duration_seconds", duration, view=view)
+        observe("blog_db_queries_per_request", queries.count, view=view)
+        session = getattr(request, "session", None)
+        if session is not None and session.modified:
+            increment("blog_session_writes_total")
+        registry.write()
+        return response
+
+
+# ==============================
+# PROMETHEUS ENDPOINT
+# ==============================
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in sorted(labels.items())
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+RETIRED = "retired.json"
+RETIRED_KEYS_KEPT = 1000
+
+
+def merge_snapshots(snapshots):
+    # -> ({name: {labels: value}}, {name: {labels: [bucket counts..., sum]}})
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = tuple(sorted(labels.items()))
+            series = counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+        for name, labels, values in snapshot["histograms"]:
+            if name not in HISTOGRAMS or len(values) != len(HISTOGRAMS[name][1]) + 2:
+                continue  # unknown metric, or its buckets changed since
+            key = tuple(sorted(labels.items()))
+            series = histograms.setdefault(name, {})
+            total = series.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+def retire_dead_workers(directory):
+    # Fold the files of exited workers into retired.json, under an exclusive
+    # lock. retired.json lists the files it already contains, so a crash
+    # between writing it and removing a file can't count the file twice.
+    if fcntl is None:
+        return
+    with open(os.path.join(directory, ".retire.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired_path = os.path.join(directory, RETIRED)
+        try:
+            retired = read_json(retired_path)
+        except (OSError, ValueError):
+            retired = {"counters": [], "histograms": [], "folded": []}
+        folded = set(retired["folded"])
+        dead = []
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            key = os.path.basename(path)[: -len(".json")]
+            pid = key.split("-")[0]
+            if not pid.isdigit() or pid_alive(int(pid)):
+                continue
+            if key in folded:
+                os.remove(path)
+                continue
+            try:
+                dead.append((key, read_json(path)))
+            except (OSError, ValueError):
+                continue
+        if not dead:
+            return
+
+        counters, histograms = merge_snapshots(
+            [retired] + [snapshot for _, snapshot in dead]
+        )
+        keys = retired["folded"] + [key for key, _ in dead]
+        write_json(
+            retired_path,
+            {
+                "counters": [
+                    [name, dict(labels), value]
+                    for name, series in counters.items()
+                    for labels, value in series.items()
+                ],
+                "histograms": [
+                    [name, dict(labels), values]
+                    for name, series in histograms.items()
+                    for labels, values in series.items()
+                ],
+                "folded": keys[-RETIRED_KEYS_KEPT:],
+            },
+        )
+        for key, _ in dead:
+            os.remove(os.path.join(directory, f"{key}.json"))
+
+
+def load_snapshots():
+    directory = getattr(settings, "METRICS_DIR", None)
+    if not directory:
+        return [registry.snapshot()]
+    registry.write(force=True)
+    retire_dead_workers(directory)
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            snapshots.append(read_json(path))
+        except (OSError, ValueError):
+            continue  # removed or being replaced meanwhile
+    return snapshots
+
+
+def render_metrics(snapshots):
+    counters, histograms = merge_snapshots(snapshots)
+
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for key, value in sorted(counters.get(name, {}).items()):
+            lines.append(f"{name}{format_labels(dict(key))} {value}")
+    for name, (help_text, bounds) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for key, values in sorted(histograms.get(name, {}).items()):
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip((*bounds, "+Inf"), values[:-1]):
+                cumulative += count
+                le = format_labels({**labels, "le": bound})
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    allowed = getattr(settings, "METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"])
+    if client_ip(request) not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(load_snapshots()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.14 on 2026-10-19 19:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    # Replies are always created after their parent, so walking comments in
+    # id order sees every parent before its children.
+    Comment = apps.get_model('blog', 'Comment')
+    threads = {}
+    batch = []
+    comments = Comment.objects.order_by('pk').values_list('pk', 'parent_id')
+    for pk, parent_id in comments.iterator():
+        parent = threads.get(parent_id)
+        path = (parent[0] if parent else '') + f'{pk:010d}/'
+        depth = parent[1] + 1 if parent else 0
+        root_id = parent[2] if parent else pk
+        threads[pk] = (path, depth, root_id)
+        batch.append(Comment(pk=pk, path=path, depth=depth, root_id=root_id))
+        if len(batch) >= 500:
+            Comment.objects.bulk_update(batch, ['path', 'depth', 'root'])
+            batch = []
+    Comment.objects.bulk_update(batch, ['path', 'depth', 'root'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_postviewbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_comments', to='blog.comment'),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'root', 'path'], name='blog_commen_post_id_1dfacf_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.14 on 2026-10-19 19:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaDirectory',
+            fields=[
+                ('path', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('parent', models.CharField(db_index=True, max_length=255, null=True)),
+                ('mtime_ns', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('directory', models.CharField(db_index=True, max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('mtime', models.FloatField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=255)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_references', to='blog.post')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'name'), name='unique_post_media_reference')],
+            },
+        ),
+    ]
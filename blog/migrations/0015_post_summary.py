@@ -0,0 +1,50 @@
+# Generated by Django 5.1.14 on 2026-10-19 19:45
+
+import re
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+
+def summarize(text, word_limit):
+    # Frozen copy of blog.models.summarize() as of this migration
+    text_stripped = re.sub(r'^(\s|&nbsp;)+', '', strip_tags(text))
+    words = text_stripped.split()
+    if len(words) > word_limit:
+        return ' '.join(words[:word_limit]) + '...'
+    return text_stripped
+
+
+def backfill_summaries(apps, schema_editor):
+    # Historical models don't run Post.save(), so fill both fields here
+    Post = apps.get_model('blog', 'Post')
+    batch = []
+    for post in Post.objects.only('pk', 'text', 'created_date', 'published_date').iterator():
+        post.summary = summarize(post.text, 60)
+        post.updated_date = post.published_date or post.created_date
+        batch.append(post)
+        if len(batch) >= 500:
+            Post.objects.bulk_update(batch, ['summary', 'updated_date'])
+            batch = []
+    Post.objects.bulk_update(batch, ['summary', 'updated_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_media_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='summary',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.14 on 2026-10-19 19:46
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def schedule_future_posts(apps, schema_editor):
+    # Posts given a future published_date used to appear whenever a cache
+    # happened to expire; queue them for the scheduler instead
+    Post = apps.get_model('blog', 'Post')
+    for post in Post.objects.filter(published_date__gt=timezone.now()):
+        post.scheduled_date = post.published_date
+        post.published_date = None
+        post.save(update_fields=['scheduled_date', 'published_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_post_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='scheduled_date',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(schedule_future_posts, migrations.RunPython.noop),
+    ]
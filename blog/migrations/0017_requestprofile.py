@@ -0,0 +1,34 @@
+# Generated by Django 5.1.14 on 2026-10-19 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_post_scheduled_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('url_name', models.CharField(blank=True, max_length=200)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('trigger', models.CharField(choices=[('staff', 'Requested by staff'), ('sample', 'Sampled')], max_length=6)),
+                ('duration_ms', models.FloatField()),
+                ('sql_count', models.PositiveIntegerField()),
+                ('sql_time_ms', models.FloatField()),
+                ('call_tree', models.TextField()),
+                ('stats', models.TextField()),
+                ('sql_trace', models.TextField()),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.14 on 2026-10-19 19:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_archive(apps, schema_editor):
+    # Same counts as blog.archive.rebuild_archive_index(), on historical models
+    Post = apps.get_model('blog', 'Post')
+    ArchiveBucket = apps.get_model('blog', 'ArchiveBucket')
+    buckets = {}
+    posts = Post.objects.filter(published_date__lte=timezone.now()).order_by(
+        'published_date', 'pk'
+    )
+    for published_date, pk, author_id in posts.values_list(
+        'published_date', 'pk', 'author_id'
+    ).iterator():
+        month = timezone.localtime(published_date).date().replace(day=1)
+        for key in (('month', month), ('author', author_id)):
+            bucket = buckets.setdefault(key, {'post_count': 0})
+            # Posts come oldest first, so the last one seen is the newest
+            bucket['post_count'] += 1
+            bucket['latest_published_date'] = published_date
+            bucket['latest_post_id'] = pk
+    ArchiveBucket.objects.bulk_create(
+        [
+            ArchiveBucket(
+                kind=kind,
+                month=key if kind == 'month' else None,
+                author_id=key if kind == 'author' else None,
+                **fields,
+            )
+            for (kind, key), fields in buckets.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_requestprofile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('month', 'Month'), ('author', 'Author')], max_length=6)),
+                ('month', models.DateField(blank=True, null=True)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('latest_published_date', models.DateTimeField(blank=True, null=True)),
+                ('latest_post_id', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['published_date', 'id'], name='post_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'published_date', 'id'], name='post_author_published_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivebucket',
+            name='author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='archivebucket',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'month')), fields=('kind', 'month'), name='unique_archive_month'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivebucket',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'author')), fields=('kind', 'author'), name='unique_archive_author'),
+        ),
+        migrations.RunPython(backfill_archive, migrations.RunPython.noop),
+    ]
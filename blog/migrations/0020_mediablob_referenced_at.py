@@ -0,0 +1,19 @@
+# Generated by Django 5.1.14 on 2026-10-19 20:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0019_autocomplete_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='referenced_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
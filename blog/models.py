@@ -1,4 +1,7 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Max, Value
+from django.db.models.functions import Concat, Substr
 from django.conf import settings
 from django.utils import timezone
 import re
@@ -27,6 +30,17 @@ class CommentReaction(models.Model):
 # ==============================
 
 
+def summarize(text, word_limit):
+    # Remove HTML tags and unnecessary spaces or blank lines, keep word_limit words
+    from django.utils.html import strip_tags
+
+    text_stripped = re.sub(r"^(\s|&nbsp;)+", "", strip_tags(text))
+    words = text_stripped.split()
+    if len(words) > word_limit:
+        return " ".join(words[:word_limit]) + "..."
+    return text_stripped
+
+
 class Post(models.Model):
     # ForeignKey to User: each post has one author
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -45,33 +59,50 @@ class Post(models.Model):
     # Timestamps
     created_date = models.DateTimeField(default=timezone.now)
     published_date = models.DateTimeField(blank=True, null=True)
+    # Drafts with a scheduled_date are published by "manage.py publish_scheduled"
+    scheduled_date = models.DateTimeField(blank=True, null=True, db_index=True)
+    updated_date = models.DateTimeField(auto_now=True)  # lastmod in sitemap/feeds
+
+    # Plain-text start of the text, used by post cards and feeds
+    summary = models.TextField(blank=True, default="", editable=False)
+    SUMMARY_WORDS = 60
 
     # View counter
     views = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        # Archive pages (blog/archive.py) walk these in published_date order
+        indexes = [
+            models.Index(fields=["published_date", "id"], name="post_published_idx"),
+            models.Index(
+                fields=["author", "published_date", "id"],
+                name="post_author_published_idx",
+            ),
+        ]
+
     def publish(self):
         # Mark post as published by setting the published_date to now.
         self.published_date = timezone.now()
+        self.scheduled_date = None
         self.save()
 
-    def increment_views(self):
-        self.views += 1
-        self.save(update_fields=["views"])
+    def save(self, *args, **kwargs):
+        # Keep the stored plain-text summary in step with the rich text
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "text" in update_fields:
+            self.summary = summarize(self.text, self.SUMMARY_WORDS)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "summary"}
+        super().save(*args, **kwargs)
 
     def preview_html(self, word_limit=20):
         # Create a short preview version of the post text for displaying in post cards
-        from django.utils.html import strip_tags
+        # (cut from the stored summary, so the rich text isn't needed)
         from django.utils.safestring import mark_safe
-        import re
 
-        text = self.text
-        # Remove HTML tags and unnecessary spaces or blank lines
-        text_stripped = re.sub(r"^(\s|&nbsp;)+", "", strip_tags(text))
-        words = text_stripped.split()
-        if len(words) > word_limit:
-            truncated = " ".join(words[:word_limit]) + "..."
-            return mark_safe(truncated)
-        return mark_safe(text_stripped)
+        if word_limit <= self.SUMMARY_WORDS:
+            return mark_safe(summarize(self.summary, word_limit))
+        return mark_safe(summarize(self.text, word_limit))
 
     def __str__(self):
         # String representation for admin/shell: show the post title.
@@ -82,6 +113,223 @@ class Post(models.Model):
         return self.comments.filter(approved_comment=True).count()
 
 
+# ==============================
+# TRENDING SCORE MODEL
+# ==============================
+
+
+class TrendingScore(models.Model):
+    # Materialized "popular now" ranking, one row per post.
+    # score is the log of the time-weighted sum of view/comment/reaction
+    # events (see blog/trending.py), so ordering by it ranks posts by their
+    # decayed popularity without ever rewriting old rows.
+    post = models.OneToOneField(
+        "blog.Post",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="trending",
+    )
+    score = models.FloatField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.post_id}: {self.score:.3f}"
+
+
+# ==============================
+# VIEW ANALYTICS MODEL
+# ==============================
+
+
+class PostViewBucket(models.Model):
+    # Views of one post during one hour or one day.
+    # Hourly buckets are written by the view aggregator (blog/analytics.py)
+    # and folded into daily buckets by the compact_view_buckets command.
+    HOUR = "hour"
+    DAY = "day"
+    GRANULARITY_CHOICES = ((HOUR, "Hour"), (DAY, "Day"))
+
+    post = models.ForeignKey(
+        "blog.Post", on_delete=models.CASCADE, related_name="view_buckets"
+    )
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "granularity", "bucket_start"],
+                name="unique_post_view_bucket",
+            )
+        ]
+        indexes = [models.Index(fields=["granularity", "bucket_start"])]
+
+    def __str__(self):
+        return f"{self.post_id} {self.granularity} {self.bucket_start}: {self.views}"
+
+
+# ==============================
+# MEDIA BLOB MODEL
+# ==============================
+
+
+class MediaBlob(models.Model):
+    # One stored file per distinct content (see DeduplicatingFileSystemStorage
+    # in blog/storage.py). Uploading the same bytes again reuses `name` and
+    # bumps refcount; deleting through the storage decrements it and removes
+    # the file when nothing uses it any more.
+    digest = models.CharField(max_length=64, unique=True)  # SHA-256, hex
+    name = models.CharField(max_length=255, unique=True)  # path in MEDIA_ROOT
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last upload stored as (or deduplicated onto) this file; the orphan
+    # sweeper's grace period counts from here, not from the file's mtime
+    referenced_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+
+# ==============================
+# ARCHIVE INDEX MODEL
+# ==============================
+
+
+class ArchiveBucket(models.Model):
+    # Published post count per month or per author, kept up to date by the
+    # Post signals in blog/signals.py (see blog/archive.py), so the archive
+    # index never has to GROUP BY the post table.
+    MONTH = "month"
+    AUTHOR = "author"
+    KIND_CHOICES = ((MONTH, "Month"), (AUTHOR, "Author"))
+
+    kind = models.CharField(max_length=6, choices=KIND_CHOICES)
+    month = models.DateField(null=True, blank=True)  # first day, site TIME_ZONE
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True
+    )
+    post_count = models.PositiveIntegerField(default=0)
+    # Keyset entry point: the newest post in the bucket
+    latest_published_date = models.DateTimeField(null=True, blank=True)
+    latest_post_id = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "month"],
+                condition=models.Q(kind="month"),
+                name="unique_archive_month",
+            ),
+            models.UniqueConstraint(
+                fields=["kind", "author"],
+                condition=models.Q(kind="author"),
+                name="unique_archive_author",
+            ),
+        ]
+
+    def __str__(self):
+        if self.kind == self.MONTH:
+            return f"{self.month:%B %Y} ({self.post_count})"
+        return f"{self.author} ({self.post_count})"
+
+
+# ==============================
+# MEDIA INDEX MODELS
+# ==============================
+# Used by the sweep_media command (see blog/media_index.py) to find files in
+# MEDIA_ROOT that no post references any more.
+
+
+class MediaReference(models.Model):
+    # A file used by a post: its image, or a src/href URL inside its text.
+    # Kept up to date whenever a post is saved.
+    post = models.ForeignKey(
+        "blog.Post", on_delete=models.CASCADE, related_name="media_references"
+    )
+    name = models.CharField(max_length=255, db_index=True)  # path in MEDIA_ROOT
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "name"], name="unique_post_media_reference"
+            )
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class MediaDirectory(models.Model):
+    # Scan checkpoint: a directory is only listed again when its mtime
+    # changed (a file was added, removed or renamed in it)
+    path = models.CharField(max_length=255, primary_key=True)  # "" is MEDIA_ROOT
+    parent = models.CharField(max_length=255, null=True, db_index=True)
+    mtime_ns = models.BigIntegerField()
+
+    def __str__(self):
+        return self.path or "/"
+
+
+class MediaFile(models.Model):
+    # A file found in MEDIA_ROOT by the last scan of its directory
+    name = models.CharField(max_length=255, primary_key=True)
+    directory = models.CharField(max_length=255, db_index=True)
+    size = models.PositiveBigIntegerField()
+    mtime = models.FloatField(db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
+# ==============================
+# REQUEST PROFILE MODEL
+# ==============================
+
+
+class RequestProfile(models.Model):
+    # One profiled request, stored by blog.profiling.ProfilingMiddleware
+    STAFF = "staff"
+    SAMPLE = "sample"
+    TRIGGER_CHOICES = ((STAFF, "Requested by staff"), (SAMPLE, "Sampled"))
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    url_name = models.CharField(max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    trigger = models.CharField(max_length=6, choices=TRIGGER_CHOICES)
+    duration_ms = models.FloatField()
+    sql_count = models.PositiveIntegerField()
+    sql_time_ms = models.FloatField()
+    call_tree = models.TextField()  # indented tree, cumulative time per call path
+    stats = models.TextField()  # pstats listing sorted by cumulative time
+    sql_trace = models.TextField()  # one "<ms> <sql>" line per query
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+# ==============================
+# AUTOCOMPLETE CHANGE LOG
+# ==============================
+
+
+class AutocompleteChange(models.Model):
+    # A post whose title entry changed (saved, published or deleted); every
+    # worker replays the rows newer than the last one it applied to its
+    # in-memory title index (see blog/autocomplete.py). Not a foreign key:
+    # the post may be gone.
+    post_id = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"#{self.pk}: post {self.post_id}"
+
+
 # ==============================
 # COMMENT MODEL
 # ==============================
@@ -98,6 +346,24 @@ class Comment(models.Model):
         "self", null=True, blank=True, related_name="replies", on_delete=models.CASCADE
     )
 
+    # Thread storage (maintained in save()):
+    # - path: zero-padded ids of all ancestors and of the comment itself, so
+    #   sorting by path lists a thread in display order and a subtree is a
+    #   single "path starts with" query
+    # - depth: 0 for top-level comments, 1 for replies, 2 for replies to
+    #   replies, ...
+    # - root: the top-level comment of the thread (itself for top-level ones)
+    path = models.CharField(max_length=255, db_index=True, editable=False, default="")
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    root = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="thread_comments",
+        on_delete=models.CASCADE,
+    )
+
     # Comment content
     author = models.CharField(max_length=200)
     text = models.TextField()
@@ -112,11 +378,73 @@ class Comment(models.Model):
     likes = models.PositiveIntegerField(default=0)
     dislikes = models.PositiveIntegerField(default=0)
 
+    # Each path step is a 10-digit id plus "/", which bounds the depth
+    PATH_STEP = 11
+    MAX_DEPTH = 255 // PATH_STEP - 1
+
     def approve(self):
         # Mark this comment as approved.
         self.approved_comment = True
         self.save()
 
+    def clean(self):
+        # Moving a comment (e.g. in the admin) moves its replies along
+        parent = self.parent
+        if parent is None:
+            return
+        if parent.post_id != self.post_id:
+            raise ValidationError(
+                {"parent": "The parent comment belongs to another post."}
+            )
+        if not self.path:
+            return
+        if parent.path.startswith(self.path):
+            raise ValidationError(
+                {"parent": "A comment can't be a reply to one of its own replies."}
+            )
+        deepest = self.subtree().aggregate(deepest=Max("depth"))["deepest"]
+        if parent.depth + 1 + deepest - self.depth > self.MAX_DEPTH:
+            raise ValidationError(
+                {"parent": "Its replies would be nested too deeply there."}
+            )
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        # Threads deeper than MAX_DEPTH continue at the deepest level
+        if self.parent_id and self.parent.depth >= self.MAX_DEPTH:
+            self.parent_id = self.parent.parent_id
+        if self.path and self.parent_id and self.parent.path.startswith(self.path):
+            raise ValueError("A comment can't be a reply to one of its own replies.")
+        super().save(*args, **kwargs)
+        if update_fields is not None and "parent" not in update_fields:
+            return
+        # The path contains our own id, so it can only be set after INSERT
+        parent = self.parent
+        path = (parent.path if parent else "") + f"{self.pk:010d}/"
+        depth = parent.depth + 1 if parent else 0
+        root_id = parent.root_id if parent else self.pk
+        if (self.path, self.depth, self.root_id) == (path, depth, root_id):
+            return
+        old_path, old_depth = self.path, self.depth
+        self.path, self.depth, self.root_id = path, depth, root_id
+        with transaction.atomic():
+            Comment.objects.filter(pk=self.pk).update(
+                path=path, depth=depth, root_id=root_id
+            )
+            if old_path and old_path != path:
+                # Moved: the replies get the new path prefix, depth and root
+                Comment.objects.filter(path__startswith=old_path).exclude(
+                    pk=self.pk
+                ).update(
+                    path=Concat(Value(path), Substr("path", len(old_path) + 1)),
+                    depth=F("depth") + depth - old_depth,
+                    root_id=root_id,
+                )
+
+    def subtree(self):
+        # This comment and all of its replies at any depth, in display order
+        return Comment.objects.filter(path__startswith=self.path).order_by("path")
+
     def __str__(self):
         # String representation: show the first 50 chars of the comment text.
         return self.text[:50]
@@ -124,3 +452,4 @@ class Comment(models.Model):
     class Meta:
         # Order comments by newest first
         ordering = ["-created_date"]
+        indexes = [models.Index(fields=["post", "root", "path"])]
@@ -0,0 +1,167 @@
+import cProfile
+import io
+import itertools
+import logging
+import pstats
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# ON-DEMAND REQUEST PROFILER
+# ==============================
+# ProfilingMiddleware profiles a request when
+# - a staff user asks for it with the "X-Profile: 1" header or a "?profile"
+#   query parameter, or
+# - it is the N-th request of this worker (PROFILING_SAMPLE_EVERY = N, 0 = off).
+#
+# A profile is the cProfile call tree of the view plus every SQL query with
+# its duration, stored as a RequestProfile row and listed in the admin
+# (only the newest PROFILING_KEEP rows are kept). Requests that aren't
+# profiled only pay for a header/query lookup and a counter increment; the
+# user is only loaded once a profile was asked for.
+#
+# Only one request per worker is profiled at a time (Python allows a single
+# active profiler); a trigger that arrives meanwhile is ignored.
+
+TREE_MIN_FRACTION = 0.01  # hide call paths under 1% of the request time
+TREE_MAX_DEPTH = 40
+STATS_LINES = 40
+
+
+class SQLTrace:
+    # connection.execute_wrapper() callback recording (seconds, sql)
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - started, sql))
+
+    def text(self):
+        return "\n".join(
+            f"{seconds * 1000:8.2f} ms  {sql}" for seconds, sql in self.queries
+        )
+
+
+def function_label(func):
+    filename, line, name = func
+    if filename == "~":
+        return name  # built-in, e.g. "<method 'execute' ...>"
+    return f"{name} ({filename}:{line})"
+
+
+def call_tree(stats):
+    # Render the profile as an indented tree; each line shows the time spent
+    # in a function when called from its parent (a text flame graph)
+    children = {}
+    roots = []
+    for func, (_, _, _, cumulative, callers) in stats.stats.items():
+        if not callers:
+            roots.append((cumulative, func))
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((edge[3], func))
+    total = max((cumulative for cumulative, _ in roots), default=0) or 1
+
+    lines = []
+
+    def walk(func, cumulative, depth, path):
+        share = cumulative / total
+        if share < TREE_MIN_FRACTION or depth > TREE_MAX_DEPTH or func in path:
+            return
+        bar = "#" * max(int(share * 20), 1)
+        lines.append(
+            f"{cumulative * 1000:9.1f} ms {share:6.1%} {bar:<20} "
+            f"{'  ' * depth}{function_label(func)}"
+        )
+        for child_time, child in sorted(children.get(func, ()), reverse=True):
+            walk(child, child_time, depth + 1, path | {func})
+
+    for cumulative, func in sorted(roots, reverse=True):
+        walk(func, cumulative, 0, frozenset())
+    return "\n".join(lines)
+
+
+def stats_text(stats):
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats("cumulative").print_stats(STATS_LINES)
+    return output.getvalue()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_every = getattr(settings, "PROFILING_SAMPLE_EVERY", 0)
+        self.keep = getattr(settings, "PROFILING_KEEP", 200)
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def trigger(self, request):
+        if "HTTP_X_PROFILE" in request.META or "profile" in request.GET:
+            user = getattr(request, "user", None)
+            if user is not None and user.is_staff:
+                return "staff"
+        if self.sample_every and next(self.counter) % self.sample_every == 0:
+            return "sample"
+        return None
+
+    def __call__(self, request):
+        trigger = self.trigger(request)
+        if trigger is None or not self.lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request, trigger)
+        finally:
+            self.lock.release()
+
+    def profile(self, request, trigger):
+        profiler = cProfile.Profile()
+        trace = SQLTrace()
+        started = time.perf_counter()
+        with connection.execute_wrapper(trace):
+            response = profiler.runcall(self.get_response, request)
+        duration = time.perf_counter() - started
+
+        try:
+            saved = self.save(request, response, trigger, profiler, trace, duration)
+        except Exception:
+            # Profiling must never break the request itself
+            logger.exception("Could not store request profile")
+        else:
+            if trigger == "staff":
+                response["X-Profile-Id"] = str(saved.pk)
+        return response
+
+    def save(self, request, response, trigger, profiler, trace, duration):
+        from .models import RequestProfile
+
+        stats = pstats.Stats(profiler)
+        match = request.resolver_match
+        profile = RequestProfile.objects.create(
+            method=request.method,
+            path=request.get_full_path()[:500],
+            url_name=(match.view_name if match else "")[:200],
+            status_code=response.status_code,
+            trigger=trigger,
+            duration_ms=duration * 1000,
+            sql_count=len(trace.queries),
+            sql_time_ms=sum(seconds for seconds, _ in trace.queries) * 1000,
+            call_tree=call_tree(stats),
+            stats=stats_text(stats),
+            sql_trace=trace.text(),
+        )
+        # Keep only the newest profiles
+        stale = RequestProfile.objects.order_by("-pk").values_list("pk", flat=True)[
+            self.keep : self.keep + 1
+        ]
+        if stale:
+            RequestProfile.objects.filter(pk__lte=stale[0]).delete()
+        return profile
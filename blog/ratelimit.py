@@ -0,0 +1,173 @@
+import functools
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+# ==============================
+# RATE LIMITING FOR WRITE ENDPOINTS
+# ==============================
+# Views are wrapped in blog/urls.py, e.g.
+#
+#   path("comment/<int:pk>/like/", ratelimit(views.comment_like, per_ip="60/m"), ...)
+#
+# Only POST requests are limited. The check runs before the view, uses the
+# raw session cookie (no session lookup) and the shared cache, so a rejected
+# request never touches the database.
+
+PERIODS = {"s": 1, "m": 60, "h": 3600}
+
+
+def parse_rate(rate):
+    # "30/m" -> (capacity 30, refill 0.5 tokens per second)
+    count, period = rate.split("/")
+    return int(count), int(count) / PERIODS[period]
+
+
+def rate_cache():
+    # Buckets must be shared by all workers and change on every request,
+    # so they bypass the in-process tier of the default cache
+    return caches[getattr(settings, "RATELIMIT_CACHE", "shared")]
+
+
+def take_token(key, rate, now=None):
+    # Token bucket stored as (tokens, timestamp). The read-modify-write is not
+    # atomic across workers; a burst can get a few extra requests through,
+    # which is fine for abuse protection.
+    capacity, refill = parse_rate(rate)
+    now = now or time.time()
+    cache = rate_cache()
+    tokens, stamp = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - stamp) * refill)
+    if tokens < 1:
+        return False, (1 - tokens) / refill
+    # Keep the bucket until it would be full again anyway
+    cache.set(key, (tokens - 1, now), int(capacity / refill) + 1)
+    return True, 0
+
+
+def client_ip(request):
+    if getattr(settings, "RATELIMIT_TRUST_X_FORWARDED_FOR", False):
+        forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def too_many_requests(retry_after, status=429):
+    message = (
+        "Too many requests, please try again later."
+        if status == 429
+        else "The server is busy, please try again later."
+    )
+    response = HttpResponse(message, status=status, content_type="text/plain")
+    response["Retry-After"] = str(max(int(retry_after + 0.999), 1))
+    return response
+
+
+# ==============================
+# LOAD SHEDDING
+# ==============================
+# Each worker keeps an exponentially weighted average of write latency and
+# publishes it to the shared cache once a second; the highest recent value
+# of any worker is the global latency. While it is above
+# LOAD_SHED_WRITE_LATENCY_MS a matching share of writes is rejected with 503
+# (e.g. 1000 ms against a 500 ms threshold sheds half), so the remaining
+# writes keep measuring the latency and shedding stops once it recovers.
+
+
+class WriteLatency:
+    PUBLISH_INTERVAL = 1.0
+    STALE_AFTER = 30
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.average = None
+        self._published_at = 0
+        self._global = 0
+        self._global_read_at = 0
+        self._lock = threading.Lock()
+        self._key = f"ratelimit:write-latency:{os.getpid()}"
+
+    def observe(self, seconds):
+        with self._lock:
+            if self.average is None:
+                self.average = seconds
+            else:
+                self.average += self.alpha * (seconds - self.average)
+            now = time.time()
+            publish = now - self._published_at >= self.PUBLISH_INTERVAL
+            if publish:
+                self._published_at = now
+        if publish:
+            cache = rate_cache()
+            cache.set(self._key, self.average, self.STALE_AFTER)
+            workers = set(cache.get("ratelimit:write-latency:workers", ()))
+            if self._key not in workers:
+                workers.add(self._key)
+                cache.set("ratelimit:write-latency:workers", workers, None)
+
+    def global_average(self):
+        # Re-read the other workers' values at most once a second
+        now = time.time()
+        if now - self._global_read_at >= self.PUBLISH_INTERVAL:
+            self._global_read_at = now
+            cache = rate_cache()
+            workers = cache.get("ratelimit:write-latency:workers", set())
+            live = cache.get_many(list(workers))
+            if len(live) < len(workers):
+                # Forget workers that stopped publishing (restarted/exited)
+                cache.set("ratelimit:write-latency:workers", set(live), None)
+            self._global = max(live.values(), default=0)
+        return self._global
+
+
+write_latency = WriteLatency()
+
+
+def should_shed():
+    threshold = getattr(settings, "LOAD_SHED_WRITE_LATENCY_MS", 500) / 1000
+    latency = write_latency.global_average()
+    if not threshold or latency <= threshold:
+        return False
+    return random.random() < 1 - threshold / latency
+
+
+# ==============================
+# VIEW WRAPPER
+# ==============================
+
+
+def ratelimit(view, per_ip="60/m", per_session="20/m"):
+    # per_ip/per_session are "<count>/<s|m|h>" rates (None disables a limit)
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if request.method != "POST":
+            return view(request, *args, **kwargs)
+
+        if should_shed():
+            return too_many_requests(5, status=503)
+
+        match = request.resolver_match
+        scope = match.url_name if match and match.url_name else view.__name__
+        buckets = []
+        if per_ip:
+            buckets.append((f"ratelimit:{scope}:ip:{client_ip(request)}", per_ip))
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if per_session and session_key:
+            buckets.append((f"ratelimit:{scope}:session:{session_key}", per_session))
+        for key, rate in buckets:
+            allowed, retry_after = take_token(key, rate)
+            if not allowed:
+                return too_many_requests(retry_after)
+
+        started = time.monotonic()
+        response = view(request, *args, **kwargs)
+        write_latency.observe(time.monotonic() - started)
+        return response
+
+    return wrapped
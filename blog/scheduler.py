@@ -0,0 +1,51 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Post
+
+# ==============================
+# SCHEDULED PUBLISHING
+# ==============================
+# Drafts with a scheduled_date are published by "manage.py publish_scheduled"
+# (run it as a long-lived process, or with --once from cron). Publishing goes
+# through Post.save(), so the signals in blog/signals.py drop the homepage
+# and feed caches the moment a post goes live; those caches can therefore
+# be kept for a long time instead of expiring "just in case".
+
+
+def due_posts(now=None):
+    return Post.objects.filter(
+        published_date__isnull=True, scheduled_date__lte=now or timezone.now()
+    ).order_by("scheduled_date", "pk")
+
+
+def next_scheduled():
+    # Datetime of the next queued post, or None
+    return (
+        Post.objects.filter(published_date__isnull=True, scheduled_date__isnull=False)
+        .order_by("scheduled_date")
+        .values_list("scheduled_date", flat=True)
+        .first()
+    )
+
+
+def publish_due_posts(now=None, batch_size=100):
+    # Publish every post whose time has come, one transaction per batch.
+    # Rows are locked (on databases that support it) so two schedulers
+    # never publish the same post twice. Returns the published posts.
+    published = []
+    while True:
+        with transaction.atomic():
+            batch = list(
+                due_posts(now).select_for_update(skip_locked=True)[:batch_size]
+            )
+            for post in batch:
+                # Keep the announced time, even if the scheduler runs late
+                post.published_date = post.scheduled_date
+                post.scheduled_date = None
+                post.save(
+                    update_fields=["published_date", "scheduled_date", "updated_date"]
+                )
+        published.extend(batch)
+        if len(batch) < batch_size:
+            return published
@@ -0,0 +1,246 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+# ==============================
+# STATIC FILE SERVING (production)
+# ==============================
+# Serves files collected into STATIC_ROOT when DEBUG is off (see
+# mysite/urls.py); files that weren't collected are looked up in the apps'
+# static/ directories instead, so the site works before collectstatic. If
+# the browser accepts it, the precompressed .br or .gz variant written by
+# blog/storage.py is sent instead of the original, and content-hashed names
+# are marked immutable so repeat visits don't even revalidate them.
+
+# blog.4d3f1a2b9c0e.css: the 12 hex digits are added by ManifestStaticFilesStorage
+HASHED_NAME = re.compile(r"\.[0-9a-f]{12}\.[^./]+$")
+
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def accepted_encodings(request):
+    # The codings of ENCODINGS the client accepts, best first. Each coding
+    # gets the q-value of its own entry in Accept-Encoding, or that of "*";
+    # q=0 means refused. Equal q-values keep the ENCODINGS order.
+    qualities = {}
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    wildcard = qualities.get("*", 0.0)
+    ranked = [
+        (qualities.get(coding, wildcard), coding)
+        for coding, _ in ENCODINGS
+        if qualities.get(coding, wildcard) > 0
+    ]
+    return [coding for _, coding in sorted(ranked, key=lambda item: -item[0])]
+
+
+def find_static(path):
+    # Collected copy in STATIC_ROOT, or the source file in an app's static/
+    # directory when collectstatic hasn't been run (yet) for it
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+        if os.path.isfile(fullpath):
+            return fullpath
+        return finders.find(path)
+    except SuspiciousFileOperation:
+        return None
+
+
+def static_file(request, path):
+    fullpath = find_static(path)
+    if fullpath is None or not os.path.isfile(fullpath):
+        raise Http404("File not found")
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    encoding = None
+    suffixes = dict(ENCODINGS)
+    for coding in accepted_encodings(request):
+        if os.path.isfile(fullpath + suffixes[coding]):
+            fullpath, encoding = fullpath + suffixes[coding], coding
+            break
+
+    stat = os.stat(fullpath)
+    # A 304 carries the same caching headers, so it renews the freshness
+    # lifetime of the client's (or a proxy's) copy
+    if not was_modified_since(
+        request.headers.get("If-Modified-Since"), stat.st_mtime
+    ):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(
+            open(fullpath, "rb"),
+            content_type=content_type or "application/octet-stream",
+        )
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["Content-Length"] = stat.st_size
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Vary"] = "Accept-Encoding"
+    if HASHED_NAME.search(path):
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        response["Cache-Control"] = "public, max-age=3600"
+    return response
+
+
+# ==============================
+# MEDIA FILE SERVING (production)
+# ==============================
+# Uploaded files (post images, CKEditor uploads) are served without reading
+# them into memory:
+# - with MEDIA_SENDFILE = "x-accel-redirect" (nginx) or "x-sendfile"
+#   (Apache/lighttpd) Django only checks the request and the web server
+#   sends the file;
+# - otherwise the file is streamed in chunks, with Range support so large
+#   downloads and video seeking can resume.
+# ETags come from the file's mtime and size, so conditional requests are
+# answered with 304 after a single stat() call.
+# Hidden files and directories (any path segment starting with ".") are
+# never served.
+
+CHUNK_SIZE = 64 * 1024
+RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    # Single byte range -> (start, end) inclusive; None to serve everything;
+    # raises RangeNotSatisfiable for a range beyond the end of the file.
+    match = RANGE_HEADER.match(header.strip()) if header else None
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # "bytes=-500": the last 500 bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+
+def file_chunks(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def media_headers(response, stat, etag):
+    # Also set on 304 responses, which renew the cached copy's lifetime
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Cache-Control"] = "public, max-age=86400"
+    return response
+
+
+def media_file(request, path):
+    if any(segment.startswith(".") for segment in path.split("/")):
+        raise Http404("File not found")
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("File not found")
+    try:
+        stat = os.stat(fullpath)
+    except OSError:
+        raise Http404("File not found")
+    if not os.path.isfile(fullpath):
+        raise Http404("File not found")
+
+    etag = file_etag(stat)
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if not_modified is not None:
+        return media_headers(not_modified, stat, etag)
+
+    # The guessed encoding is not sent: foo.tar.gz is stored (and must be
+    # downloaded) as gzip bytes, not compressed for the transfer
+    content_type, _ = mimetypes.guess_type(fullpath)
+    content_type = content_type or "application/octet-stream"
+    sendfile = getattr(settings, "MEDIA_SENDFILE", None)
+
+    if sendfile:
+        # The web server reads the file (and handles Range itself)
+        response = HttpResponse(content_type=content_type)
+        if sendfile == "x-accel-redirect":
+            prefix = getattr(
+                settings, "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/"
+            )
+            response["X-Accel-Redirect"] = prefix + quote(path)
+        else:
+            response["X-Sendfile"] = fullpath
+    else:
+        byte_range = None
+        # If-Range: only honour Range if the client's copy is still current
+        if_range = request.headers.get("If-Range")
+        if not if_range or if_range == etag:
+            try:
+                byte_range = parse_range(request.headers.get("Range"), stat.st_size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{stat.st_size}"
+                return response
+
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                file_chunks(fullpath, start, length),
+                status=206,
+                content_type=content_type,
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            response["Content-Length"] = length
+        else:
+            # FileResponse uses the server's wsgi.file_wrapper (sendfile)
+            # when available and streams in chunks otherwise
+            response = FileResponse(open(fullpath, "rb"), content_type=content_type)
+            response.block_size = CHUNK_SIZE
+            response["Content-Length"] = stat.st_size
+
+    response["Accept-Ranges"] = "bytes"
+    return media_headers(response, stat, etag)
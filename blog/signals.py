@@ -0,0 +1,133 @@
+import functools
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import archive, trending
+from .autocomplete import autocomplete
+from .cache import invalidate_homepage
+from .feeds import invalidate_feeds
+from .media_index import update_references
+from .models import Comment, CommentReaction, Post
+
+# ==============================
+# CACHE INVALIDATION
+# ==============================
+# Caches are dropped once the change is committed (immediately outside a
+# transaction); dropping them earlier would let a concurrent request cache
+# the old data again until the timeout.
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, update_fields=None, **kwargs):
+    # Post cards on the homepage show title, preview, image and date;
+    # view counter updates alone are allowed to lag until the cache expires
+    if update_fields and set(update_fields) == {"views"}:
+        return
+    transaction.on_commit(invalidate_homepage)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_feeds_changed(sender, instance, update_fields=None, **kwargs):
+    # Drafts appear in neither the sitemap nor the feeds
+    if update_fields and set(update_fields) == {"views"}:
+        return
+    if instance.published_date is None:
+        return
+    transaction.on_commit(functools.partial(invalidate_feeds, instance.pk))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, update_fields=None, **kwargs):
+    # Post cards show the number of comments (but not likes/dislikes)
+    if update_fields and set(update_fields) <= {"likes", "dislikes"}:
+        return
+    transaction.on_commit(invalidate_homepage)
+
+
+# ==============================
+# TRENDING EVENTS
+# ==============================
+# Views are added by the batched view writer (blog/analytics.py)
+
+
+@receiver(post_save, sender=Comment)
+def comment_activity(sender, instance, created, **kwargs):
+    if created:
+        trending.record_event(instance.post_id, "comment")
+
+
+@receiver(post_save, sender=CommentReaction)
+def comment_reaction(sender, instance, created, **kwargs):
+    # One event per CommentReaction row, as counted by rebuild_trending (a
+    # user switching from like to dislike doesn't count twice, and guest
+    # reactions are only kept in the session)
+    if created:
+        trending.record_event(instance.comment.post_id, "reaction")
+
+
+# ==============================
+# MEDIA REFERENCES
+# ==============================
+
+
+@receiver(post_save, sender=Post)
+def post_media_changed(sender, instance, update_fields=None, **kwargs):
+    # Rows of deleted posts go away with the post (on_delete=CASCADE)
+    if update_fields and not {"image", "text"} & set(update_fields):
+        return
+    update_references(instance)
+
+
+# ==============================
+# TITLE AUTOCOMPLETE
+# ==============================
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_title_changed(sender, instance, update_fields=None, **kwargs):
+    # Views alone are picked up by the periodic rebuild. Drafts are logged
+    # too (replaying one is a no-op) so unpublishing drops the title. The
+    # change is logged in this transaction and applied here on commit.
+    if update_fields and set(update_fields) == {"views"}:
+        return
+    autocomplete.record_change(instance.pk)
+    transaction.on_commit(autocomplete.post_changed)
+
+
+# ==============================
+# ARCHIVE INDEX
+# ==============================
+
+
+@receiver(pre_save, sender=Post)
+def post_archive_before(sender, instance, update_fields=None, **kwargs):
+    # Remember where the post was counted, to move it if that changes
+    if update_fields and not {"published_date", "author"} & set(update_fields):
+        return
+    instance._archive_state = None
+    if instance.pk is not None:
+        instance._archive_state = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list("published_date", "author_id")
+            .first()
+        )
+
+
+@receiver(post_save, sender=Post)
+def post_archive_saved(sender, instance, update_fields=None, **kwargs):
+    if not hasattr(instance, "_archive_state"):
+        return
+    old = instance._archive_state
+    del instance._archive_state
+    archive.post_moved(old, (instance.published_date, instance.author_id))
+
+
+@receiver(post_delete, sender=Post)
+def post_archive_deleted(sender, instance, **kwargs):
+    archive.post_moved((instance.published_date, instance.author_id), None)
@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import logging
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only .gz variants are written then
+    brotli = None
+
+# ==============================
+# STATIC FILES: HASHED + PRECOMPRESSED
+# ==============================
+# collectstatic stores every file under a content-hashed name
+# (blog.css -> blog.4d3f1a2b9c0e.css, with url() references rewritten) and
+# then writes .gz (and .br when the brotli package is installed) next to the
+# text-based files. blog/serve.py picks the best variant per request.
+#
+# Before collectstatic has run (or for a file added since), there is no
+# manifest entry; instead of failing every page with "Missing staticfiles
+# manifest entry", the unhashed URL is used (served from the app's static/
+# directory by blog/serve.py) and a warning names the command to run.
+
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".html", ".txt", ".json", ".xml", ".map")
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    _warned = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if not self._warned:
+                self._warned = True
+                logger.warning(
+                    "No collected static file for %r; serving unhashed static "
+                    "files until \"manage.py collectstatic\" has been run.",
+                    name,
+                )
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(self.hashed_files.values()) | set(paths)
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.write_compressed(name)
+
+    def write_compressed(self, name):
+        with self.open(name) as source:
+            content = source.read()
+        variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(content)
+        for suffix, compressed in variants.items():
+            # Not worth serving if it doesn't save anything
+            if len(compressed) >= len(content):
+                continue
+            path = self.path(name + suffix)
+            with open(path, "wb") as target:
+                target.write(compressed)
+
+
+# ==============================
+# MEDIA: CONTENT-ADDRESSED, DEDUPLICATED
+# ==============================
+# Default storage for Post.image and CKEditor uploads. Every upload is hashed
+# (streamed chunk by chunk); if a file with the same content is already
+# stored, its name is returned instead of writing a copy such as
+# 1_VNqwwZN.avif. MediaBlob keeps one row per content digest with a
+# reference count. Existing duplicates are folded by "manage.py dedupe_media".
+
+
+def content_digest(content):
+    # SHA-256 and size of an uploaded file (File.chunks() rewinds first)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in content.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class DeduplicatingFileSystemStorage(FileSystemStorage):
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        digest, size = content_digest(content)
+        blob = MediaBlob.objects.filter(digest=digest).first()
+        if blob is not None and self.exists(blob.name):
+            MediaBlob.objects.filter(pk=blob.pk).update(
+                refcount=F("refcount") + 1, referenced_at=timezone.now()
+            )
+            return blob.name
+
+        name = super()._save(name, content)
+        if blob is not None:
+            # The stored copy has gone missing: this upload replaces it
+            MediaBlob.objects.filter(pk=blob.pk).update(
+                name=name, size=size, refcount=1, referenced_at=timezone.now()
+            )
+            return name
+        try:
+            with transaction.atomic():
+                MediaBlob.objects.create(digest=digest, name=name, size=size)
+        except IntegrityError:
+            # Same content uploaded concurrently: use the other copy and drop
+            # this one, so no file is left on disk without a MediaBlob row
+            blob = MediaBlob.objects.filter(digest=digest).first()
+            if blob is None or not self.exists(blob.name):
+                raise
+            MediaBlob.objects.filter(pk=blob.pk).update(
+                refcount=F("refcount") + 1, referenced_at=timezone.now()
+            )
+            super().delete(name)
+            return blob.name
+        return name
+
+    def delete(self, name):
+        from .models import MediaBlob
+
+        blob = MediaBlob.objects.filter(name=name).first()
+        if blob is not None:
+            if blob.refcount > 1:
+                # Still used by another upload of the same content
+                MediaBlob.objects.filter(pk=blob.pk).update(
+                    refcount=F("refcount") - 1
+                )
+                return
+            blob.delete()
+        super().delete(name)
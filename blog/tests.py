@@ -1,3 +1,1006 @@
-from django.test import TestCase
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, media_index
+from .analytics import ViewAggregator, day_start, hour_start
+from .autocomplete import HEAVY_PREFIX, TOP_K, WORD_START, PrefixIndex, normalize
+from .cache import TwoTierCache
+from .metrics import Registry
+from .models import (
+    ArchiveBucket,
+    Comment,
+    MediaBlob,
+    MediaFile,
+    Post,
+    PostViewBucket,
+    TrendingScore,
+)
+from .ratelimit import ratelimit, take_token
+from .serve import media_file, static_file
+from .storage import DeduplicatingFileSystemStorage
+
+# The shared tier of the two-tier cache, as an in-memory cache per test run
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tests-shared",
+    },
+}
+
+
+# ==============================
+# TWO-TIER CACHE
+# ==============================
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        # Two workers: separate local tiers over the same shared tier
+        self.workers = [self.make_worker(), self.make_worker()]
+        self.workers[0].clear()
+
+    def make_cache(self, check_interval=0):
+        return TwoTierCache(
+            "shared",
+            {
+                "OPTIONS": {
+                    "LOCAL_MAX_ENTRIES": 10,
+                    "LOCAL_TIMEOUT": 3600,
+                    "STAMP_CHECK_INTERVAL": check_interval,
+                }
+            },
+        )
+
+    def make_worker(self, check_interval=0):
+        # A cache as created in another process: with its own local tier
+        with mock.patch.dict("blog.cache.LOCAL_TIERS", clear=True):
+            return self.make_cache(check_interval)
+
+    def test_set_reaches_other_workers(self):
+        first, second = self.workers
+        first.set("key", "old")
+        self.assertEqual(second.get("key"), "old")
+        first.set("key", "new")
+        self.assertEqual(second.get("key"), "new")
+
+    def test_delete_reaches_other_workers(self):
+        first, second = self.workers
+        first.set("key", "value")
+        self.assertEqual(second.get("key"), "value")
+        first.delete("key")
+        self.assertIsNone(second.get("key"))
+        self.assertIsNone(first.get("key"))
+
+    def test_local_hit_within_check_interval(self):
+        first = self.workers[0]
+        second = self.make_worker(check_interval=60)
+        first.set("key", "old")
+        self.assertEqual(second.get("key"), "old")
+        first.set("key", "new")
+        # Served from memory until the stamp is checked again
+        self.assertEqual(second.get("key"), "old")
+        self.assertEqual(second.stats()["local_hits"], 1)
+        # The copy hasn't expired, but its stamp is stale
+        later = time.monotonic() + 120
+        with mock.patch("blog.cache.time.monotonic", return_value=later):
+            self.assertEqual(second.get("key"), "new")
+
+    def test_unchanged_stamp_keeps_local_copy(self):
+        first, second = self.workers
+        first.set("key", "value")
+        second.get("key")
+        with mock.patch.object(second, "_load") as load:
+            self.assertEqual(second.get("key"), "value")
+        load.assert_not_called()
+
+    def test_local_tier_is_bounded(self):
+        worker = self.workers[0]
+        for i in range(15):
+            worker.set(f"key{i}", i)
+        self.assertEqual(len(worker.local), 10)
+        self.assertEqual(worker.local.evictions, 5)
+        # Evicted entries are still in the shared tier
+        self.assertEqual(worker.get("key0"), 0)
+
+    def test_threads_share_the_local_tier(self):
+        # Django creates a cache instance per thread
+        with mock.patch.dict("blog.cache.LOCAL_TIERS", clear=True):
+            instances = []
+            threads = [
+                threading.Thread(target=lambda: instances.append(self.make_cache()))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len({id(instance.local) for instance in instances}), 1)
+        instances[0].set("key", "value")
+        self.assertEqual([i.get("key") for i in instances], ["value"] * 4)
+        stats = instances[3].stats()
+        self.assertEqual((stats["local_hits"], stats["shared_hits"]), (4, 0))
+
+    @override_settings(
+        CACHES={
+            **SHARED_CACHES,
+            "default": {"BACKEND": "blog.cache.TwoTierCache", "LOCATION": "shared"},
+        }
+    )
+    def test_metrics_count_hits_of_every_thread(self):
+        def lookups():
+            caches["default"].set("key", "value")
+            for _ in range(5):
+                caches["default"].get("key")
+
+        with mock.patch.dict("blog.cache.LOCAL_TIERS", clear=True):
+            thread = threading.Thread(target=lookups)
+            thread.start()
+            thread.join()
+            counters = {
+                (labels["tier"], labels["result"]): value
+                for name, labels, value in Registry().snapshot()["counters"]
+                if name == "blog_cache_requests_total"
+            }
+        self.assertEqual(counters[("local", "hit")], 5)
+
+    def test_cached_values_are_copies(self):
+        worker = self.workers[0]
+        worker.set("key", [1])
+        worker.get("key").append(2)
+        self.assertEqual(worker.get("key"), [1])
+
+
+# ==============================
+# COMMENT THREADS
+# ==============================
+
+
+def make_post(title="Post", author=None, **fields):
+    author = author or User.objects.get_or_create(username="author")[0]
+    fields.setdefault("published_date", timezone.now())
+    return Post.objects.create(author=author, title=title, text="Text", **fields)
+
+
+def make_comment(post, parent=None, approved=True):
+    return Comment.objects.create(
+        post=post, parent=parent, author="Guest", text="Hi", approved_comment=approved
+    )
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class CommentPathTests(TestCase):
+    def setUp(self):
+        self.post = make_post()
+
+    def test_path_depth_and_root(self):
+        root = make_comment(self.post)
+        reply = make_comment(self.post, parent=root)
+        nested = make_comment(self.post, parent=reply)
+        self.assertEqual(root.path, f"{root.pk:010d}/")
+        self.assertEqual(
+            nested.path, f"{root.pk:010d}/{reply.pk:010d}/{nested.pk:010d}/"
+        )
+        self.assertEqual([c.depth for c in (root, reply, nested)], [0, 1, 2])
+        self.assertEqual({c.root_id for c in (root, reply, nested)}, {root.pk})
+        # Stored as well, not only set on the instances
+        nested.refresh_from_db()
+        self.assertEqual((nested.depth, nested.root_id), (2, root.pk))
+
+    def test_subtree_in_display_order(self):
+        root = make_comment(self.post)
+        first = make_comment(self.post, parent=root)
+        second = make_comment(self.post, parent=root)
+        under_first = make_comment(self.post, parent=first)
+        make_comment(self.post)
+        self.assertEqual(list(root.subtree()), [root, first, under_first, second])
+
+    def test_deep_threads_continue_at_max_depth(self):
+        comment = make_comment(self.post)
+        for _ in range(Comment.MAX_DEPTH + 3):
+            comment = make_comment(self.post, parent=comment)
+        self.assertEqual(comment.depth, Comment.MAX_DEPTH)
+        self.assertLessEqual(len(comment.path), 255)
+
+    def test_moving_a_comment_moves_its_replies(self):
+        first = make_comment(self.post)
+        second = make_comment(self.post)
+        moved = make_comment(self.post, parent=first)
+        reply = make_comment(self.post, parent=moved)
+        nested = make_comment(self.post, parent=reply)
+        sibling = make_comment(self.post, parent=first)
+
+        moved.parent = second
+        moved.save()
+        self.assertEqual(list(second.subtree()), [second, moved, reply, nested])
+        self.assertEqual(list(first.subtree()), [first, sibling])
+        nested.refresh_from_db()
+        self.assertEqual(nested.path, moved.path + f"{reply.pk:010d}/{nested.pk:010d}/")
+        self.assertEqual((nested.depth, nested.root_id), (3, second.pk))
+
+        # Becoming a top-level comment: its own thread
+        moved.parent = None
+        moved.save()
+        nested.refresh_from_db()
+        self.assertEqual((nested.depth, nested.root_id), (2, moved.pk))
+        self.assertEqual(list(moved.subtree()), [moved, reply, nested])
+
+    def test_moves_that_break_the_tree_are_rejected(self):
+        root = make_comment(self.post)
+        reply = make_comment(self.post, parent=root)
+        make_comment(self.post, parent=reply)
+        deep = make_comment(self.post)
+        for _ in range(Comment.MAX_DEPTH - 1):
+            deep = make_comment(self.post, parent=deep)
+        elsewhere = make_comment(make_post(title="Other"))
+        # Under itself, its own reply, a comment of another post, or so deep
+        # that its replies would pass MAX_DEPTH
+        for parent in (root, reply, elsewhere, deep):
+            moved = Comment.objects.get(pk=root.pk)
+            moved.parent = parent
+            with self.subTest(parent=parent.pk), self.assertRaises(ValidationError):
+                moved.clean()
+        root.parent = reply
+        with self.assertRaises(ValueError):
+            root.save()
+
+    def test_saving_counters_keeps_path(self):
+        root = make_comment(self.post)
+        reply = make_comment(self.post, parent=root)
+        reply.likes = 3
+        reply.save(update_fields=["likes"])
+        reply.refresh_from_db()
+        self.assertEqual(reply.path, f"{root.pk:010d}/{reply.pk:010d}/")
+        self.assertEqual(reply.depth, 1)
+
+
+@override_settings(
+    CACHES=SHARED_CACHES,
+    COMMENT_THREADS_PER_PAGE=2,
+    COMMENT_REPLIES_PREVIEW=2,
+    COMMENT_REPLIES_PAGE=2,
+)
+class CommentPagingTests(TestCase):
+    def setUp(self):
+        self.post = make_post()
+        # Guest visits of post_detail would be buffered by blog/analytics.py
+        patcher = mock.patch("blog.views.record_view")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def thread_pages(self):
+        # Root ids of every page of threads, following the "before" cursor
+        pages, before = [], None
+        while True:
+            url = reverse("post_comments", args=[self.post.pk])
+            response = self.client.get(url, {"before": before} if before else {})
+            pages.append([t["comment"].pk for t in response.context["threads"]])
+            before = response.context["next_cursor"]
+            if before is None:
+                return pages
+
+    def reply_pages(self, root, after):
+        pages = []
+        while after:
+            url = reverse("comment_replies", args=[root.pk])
+            response = self.client.get(url, {"after": after})
+            pages.append([c.pk for c in response.context["replies"]])
+            remaining = response.context["remaining"]
+            after = response.context["after"] if remaining else None
+        return pages
+
+    def test_thread_pages(self):
+        roots = [make_comment(self.post) for _ in range(5)]
+        make_comment(self.post, parent=roots[0])
+        ids = [root.pk for root in reversed(roots)]
+        self.assertEqual(self.thread_pages(), [ids[0:2], ids[2:4], ids[4:]])
+
+    def test_reply_preview_and_pages(self):
+        root = make_comment(self.post)
+        first = make_comment(self.post, parent=root)
+        replies = [first, make_comment(self.post, parent=first)]
+        replies += [make_comment(self.post, parent=root) for _ in range(3)]
+        thread = self.client.get(
+            reverse("post_detail", args=[self.post.pk])
+        ).context["threads"][0]
+        self.assertEqual(thread["replies"], replies[:2])
+        self.assertEqual((thread["reply_count"], thread["more_replies"]), (5, 3))
+        self.assertEqual(
+            self.reply_pages(root, thread["after"]),
+            [[c.pk for c in replies[2:4]], [replies[4].pk]],
+        )
+
+    def test_guests_only_see_approved_subtrees(self):
+        root = make_comment(self.post)
+        hidden = make_comment(self.post, parent=root, approved=False)
+        under_hidden = make_comment(self.post, parent=hidden)
+        make_comment(self.post, parent=under_hidden)
+        visible = make_comment(self.post, parent=root)
+        make_comment(self.post, approved=False)
+
+        url = reverse("post_detail", args=[self.post.pk])
+        threads = self.client.get(url).context["threads"]
+        self.assertEqual([t["comment"] for t in threads], [root])
+        self.assertEqual(threads[0]["replies"], [visible])
+        self.assertEqual(threads[0]["reply_count"], 1)
+
+        self.client.force_login(User.objects.create_user("editor"))
+        threads = self.client.get(url).context["threads"]
+        self.assertEqual(len(threads), 2)
+        self.assertEqual(threads[1]["reply_count"], 4)
+
+
+# ==============================
+# RATE LIMITING
+# ==============================
+
+
+@override_settings(CACHES=SHARED_CACHES, LOAD_SHED_WRITE_LATENCY_MS=0)
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        caches["shared"].clear()
+        self.factory = RequestFactory()
+        self.view = ratelimit(lambda request: HttpResponse("ok"), per_ip="2/m")
+
+    def test_bucket_refills_over_time(self):
+        # 6/m: a capacity of 6 tokens, one more every 10 seconds
+        for _ in range(6):
+            self.assertEqual(take_token("key", "6/m", now=1000), (True, 0))
+        allowed, retry_after = take_token("key", "6/m", now=1000)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 10)
+        self.assertFalse(take_token("key", "6/m", now=1005)[0])
+        self.assertTrue(take_token("key", "6/m", now=1010)[0])
+        self.assertFalse(take_token("key", "6/m", now=1010)[0])
+
+    def test_bucket_never_exceeds_capacity(self):
+        take_token("key", "2/m", now=1000)
+        # An hour later the bucket is full again, but holds no more than 2
+        self.assertTrue(take_token("key", "2/m", now=4600)[0])
+        self.assertTrue(take_token("key", "2/m", now=4600)[0])
+        self.assertFalse(take_token("key", "2/m", now=4600)[0])
+
+    def test_post_over_the_limit_gets_429(self):
+        for _ in range(2):
+            self.assertEqual(self.view(self.factory.post("/")).status_code, 200)
+        response = self.view(self.factory.post("/"))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+
+    def test_limits_are_per_client_and_post_only(self):
+        for _ in range(2):
+            self.view(self.factory.post("/"))
+        other = self.factory.post("/", REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(self.view(other).status_code, 200)
+        self.assertEqual(self.view(self.factory.get("/")).status_code, 200)
+
+
+# ==============================
+# MEDIA FILES
+# ==============================
+
+
+class MediaFileTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        os.makedirs(os.path.join(self.root, "uploads"))
+        self.write("uploads/file.txt", b"0123456789")
+        self.factory = RequestFactory()
+        self.enterContext(override_settings(MEDIA_ROOT=self.root, MEDIA_SENDFILE=None))
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), "wb") as f:
+            f.write(data)
+
+    def get(self, path="uploads/file.txt", **headers):
+        return media_file(self.factory.get("/media/" + path, headers=headers), path)
+
+    def content(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), b"0123456789")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Content-Length"], "10")
+
+    def test_ranges(self):
+        for header, body, content_range in [
+            ("bytes=2-5", b"2345", "bytes 2-5/10"),
+            ("bytes=7-", b"789", "bytes 7-9/10"),
+            ("bytes=-3", b"789", "bytes 7-9/10"),
+            ("bytes=8-100", b"89", "bytes 8-9/10"),
+        ]:
+            with self.subTest(header):
+                response = self.get(Range=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(self.content(response), body)
+                self.assertEqual(response["Content-Range"], content_range)
+                self.assertEqual(response["Content-Length"], str(len(body)))
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range="bytes=10-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_if_range(self):
+        etag = self.get()["ETag"]
+        response = self.get(Range="bytes=0-0", If_Range=etag)
+        self.assertEqual((response.status_code, self.content(response)), (206, b"0"))
+        # The file changed since: the whole new file is sent
+        self.write("uploads/file.txt", b"abcdefghijk")
+        response = self.get(Range="bytes=0-0", If_Range=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), b"abcdefghijk")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_revalidation(self):
+        first = self.get()
+        response = self.get(If_None_Match=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        # The 304 renews the cached copy, so it carries the caching headers
+        for header in ("ETag", "Last-Modified", "Cache-Control"):
+            self.assertEqual(response[header], first[header])
+        self.assertEqual(self.get(If_None_Match='"other"').status_code, 200)
+
+    def test_static_not_modified(self):
+        self.write("app.css", b"body {}")
+        with self.settings(STATIC_ROOT=self.root):
+            first = static_file(self.factory.get("/static/app.css"), "app.css")
+            request = self.factory.get(
+                "/static/app.css", headers={"If-Modified-Since": first["Last-Modified"]}
+            )
+            response = static_file(request, "app.css")
+        self.assertEqual(response.status_code, 304)
+        for header in ("Last-Modified", "Cache-Control", "Vary"):
+            self.assertEqual(response[header], first[header])
+
+    def test_compressed_files_are_sent_as_stored(self):
+        self.write("uploads/backup.tar.gz", b"gzip bytes")
+        response = self.get("uploads/backup.tar.gz")
+        self.assertEqual(response["Content-Type"], "application/x-tar")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_paths_outside_media_root(self):
+        os.makedirs(os.path.join(self.root, ".quarantine/uploads"))
+        self.write(".quarantine/uploads/old.txt", b"x")
+        self.write("uploads/.hidden", b"x")
+        for path in [
+            "../secret.txt",
+            "uploads/missing.txt",
+            "uploads",
+            ".quarantine/uploads/old.txt",
+            "uploads/.hidden",
+        ]:
+            with self.subTest(path), self.assertRaises(Http404):
+                self.get(path)
+
+    def test_x_accel_redirect(self):
+        self.write("uploads/a b#c.txt", b"x")
+        with self.settings(MEDIA_SENDFILE="x-accel-redirect"):
+            response = self.get("uploads/a b#c.txt")
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/protected-media/uploads/a%20b%23c.txt"
+        )
+        self.assertEqual(response.content, b"")
+
+
+# ==============================
+# AUTOCOMPLETE INDEX
+# ==============================
+
+
+class PrefixIndexTests(SimpleTestCase):
+    WORDS = ["a", "ab", "abc", "b", "ba", "django", "dj", "tips", "tip", "the"]
+
+    def setUp(self):
+        rng = random.Random(42)
+        # Enough titles for heavy prefixes (precomputed top lists) and light
+        # ones (scanned); weights have ties to check the build-order rule
+        self.rows = [
+            (
+                post_id,
+                " ".join(rng.choice(self.WORDS) for _ in range(rng.randint(1, 4))),
+                rng.randint(0, 50),
+            )
+            for post_id in range(1, 400)
+        ]
+
+    def brute_force(self, rows, query, limit):
+        # Titles where the text from some word start on begins with the query
+        key = normalize(query)
+        matches = [
+            (-views, position, post_id, title)
+            for position, (post_id, title, views) in enumerate(rows)
+            if key
+            and any(
+                normalize(title)[match.start() :].startswith(key)
+                for match in WORD_START.finditer(normalize(title))
+            )
+        ]
+        return [(post_id, title) for _, _, post_id, title in sorted(matches)][:limit]
+
+    def prefixes(self):
+        return sorted(
+            {word[:n] for word in self.WORDS for n in range(1, len(word) + 1)}
+        )
+
+    def queries(self):
+        return self.prefixes() + ["TIP", " dj ", "x", "", "django tips"]
+
+    def assertMatchesBruteForce(self, index, rows):
+        for query in self.queries():
+            for limit in (1, TOP_K, TOP_K + 5):
+                with self.subTest(query=query, limit=limit):
+                    self.assertEqual(
+                        index.search(query, limit), self.brute_force(rows, query, limit)
+                    )
+
+    def test_search(self):
+        index = PrefixIndex.build(self.rows)
+        self.assertTrue(index.top, "no heavy prefixes to test")
+        self.assertTrue(all(len(slots) <= TOP_K for slots in index.top.values()))
+        self.assertMatchesBruteForce(index, self.rows)
+
+    def test_heavy_prefixes(self):
+        index = PrefixIndex.build(self.rows)
+        words = [word for _, title, _ in self.rows for word in normalize(title).split()]
+        for prefix in self.prefixes():
+            with self.subTest(prefix):
+                matching = sum(word.startswith(prefix) for word in words)
+                self.assertEqual(prefix in index.top, matching > HEAVY_PREFIX)
+
+    def test_new_weights(self):
+        index = PrefixIndex.build(self.rows)
+        rng = random.Random(7)
+        views = {post_id: rng.randint(0, 50) for post_id, _, _ in self.rows[::2]}
+        rows = [(pid, title, views.get(pid, n)) for pid, title, n in self.rows]
+        self.assertMatchesBruteForce(index.with_weights(views), rows)
+
+    def test_updates(self):
+        index = PrefixIndex.build(self.rows)
+        rows = list(self.rows)
+        # Remove the most viewed titles (they head the top lists), then add
+        # titles that must enter them
+        for post_id, _, _ in sorted(rows, key=lambda row: -row[2])[:15]:
+            index = index.without(post_id)
+            rows = [row for row in rows if row[0] != post_id]
+        for post_id, title in [(500, "Django tips"), (501, "A B"), (502, "the tip")]:
+            index = index.with_post(post_id, title, 1000 + post_id)
+            rows.append((post_id, title, 1000 + post_id))
+        self.assertEqual(len(index), len(rows))
+        self.assertMatchesBruteForce(index, rows)
+
+
+# ==============================
+# ARCHIVE INDEX
+# ==============================
+
+
+@override_settings(CACHES=SHARED_CACHES, TIME_ZONE="UTC")
+class ArchiveBucketTests(TestCase):
+    JAN = timezone.make_aware(datetime(2025, 1, 15, 12))
+    FEB = timezone.make_aware(datetime(2025, 2, 3, 8))
+
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+
+    def buckets(self):
+        # {month or username: (post count, newest post id)}; also checks that
+        # the incremental counts match a full rebuild
+        def snapshot():
+            return {
+                bucket.month or bucket.author.username: (
+                    bucket.post_count,
+                    bucket.latest_post_id,
+                )
+                for bucket in ArchiveBucket.objects.select_related("author")
+            }
+
+        counted = snapshot()
+        archive.rebuild_archive_index()
+        self.assertEqual(counted, snapshot())
+        return counted
+
+    def test_publish(self):
+        first = make_post(author=self.alice, published_date=self.JAN)
+        draft = make_post(author=self.bob, published_date=None)
+        make_post(author=self.bob, published_date=timezone.now() + timedelta(days=1))
+        self.assertEqual(
+            self.buckets(), {date(2025, 1, 1): (1, first.pk), "alice": (1, first.pk)}
+        )
+
+        draft.published_date = self.JAN + timedelta(hours=1)
+        draft.save()
+        self.assertEqual(
+            self.buckets(),
+            {
+                date(2025, 1, 1): (2, draft.pk),
+                "alice": (1, first.pk),
+                "bob": (1, draft.pk),
+            },
+        )
+
+    def test_move_between_buckets(self):
+        post = make_post(author=self.alice, published_date=self.JAN)
+        other = make_post(author=self.alice, published_date=self.JAN)
+        post.published_date = self.FEB
+        post.author = self.bob
+        post.save()
+        self.assertEqual(
+            self.buckets(),
+            {
+                date(2025, 1, 1): (1, other.pk),
+                date(2025, 2, 1): (1, post.pk),
+                "alice": (1, other.pk),
+                "bob": (1, post.pk),
+            },
+        )
+
+    def test_unrelated_saves_keep_counts(self):
+        post = make_post(author=self.alice, published_date=self.JAN)
+        post.title = "New title"
+        post.save()
+        post.views = 10
+        post.save(update_fields=["views"])
+        self.assertEqual(
+            self.buckets(), {date(2025, 1, 1): (1, post.pk), "alice": (1, post.pk)}
+        )
+
+    def test_delete_and_unpublish(self):
+        newest = make_post(author=self.alice, published_date=self.FEB)
+        older = make_post(author=self.alice, published_date=self.JAN)
+        draft = make_post(author=self.bob, published_date=self.JAN)
+        newest.delete()
+        draft.published_date = None
+        draft.save()
+        # Empty buckets are dropped, entry points move to the next post
+        self.assertEqual(
+            self.buckets(), {date(2025, 1, 1): (1, older.pk), "alice": (1, older.pk)}
+        )
+
+    def test_index_cache_is_dropped(self):
+        make_post(author=self.alice, published_date=self.JAN)
+        self.assertEqual(len(archive.archive_index()["months"]), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_post(author=self.alice, published_date=self.FEB)
+        months = archive.archive_index()["months"]
+        self.assertEqual(
+            [month["month"] for month in months], [date(2025, 2, 1), date(2025, 1, 1)]
+        )
+
+    @override_settings(ARCHIVE_PAGE_SIZE=2)
+    def test_keyset_pages(self):
+        # Equal dates are ordered by id, so no post is skipped or repeated
+        posts = [
+            make_post(author=self.alice, published_date=self.JAN) for _ in range(3)
+        ]
+        posts.append(make_post(author=self.alice, published_date=self.FEB))
+        posts.append(
+            make_post(
+                author=self.alice, published_date=self.FEB + timedelta(microseconds=1)
+            )
+        )
+        pages, cursor = [], None
+        while True:
+            page, cursor = archive.page_of_posts(
+                archive.bucket_posts(ArchiveBucket.AUTHOR, self.alice.pk), cursor
+            )
+            pages.append([post.pk for post in page])
+            if cursor is None:
+                break
+        expected = [post.pk for post in reversed(posts)]
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:]])
+
+
+# ==============================
+# MEDIA DEDUPLICATION
+# ==============================
+
+
+class MediaRootMixin:
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.enterContext(override_settings(MEDIA_ROOT=self.root))
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.root, name))
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class DeduplicatingStorageTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = DeduplicatingFileSystemStorage(location=self.root)
+
+    def test_same_content_is_stored_once(self):
+        first = self.storage.save("uploads/a.png", ContentFile(b"image"))
+        second = self.storage.save("uploads/b.png", ContentFile(b"image"))
+        other = self.storage.save("uploads/c.png", ContentFile(b"other"))
+        self.assertEqual(second, first)
+        self.assertNotEqual(other, first)
+        self.assertFalse(self.exists("uploads/b.png"))
+        blob = MediaBlob.objects.get(name=first)
+        self.assertEqual(blob.refcount, 2)
+        self.assertEqual(blob.digest, hashlib.sha256(b"image").hexdigest())
+
+    def test_delete_keeps_shared_files(self):
+        name = self.storage.save("uploads/a.png", ContentFile(b"image"))
+        self.storage.save("uploads/b.png", ContentFile(b"image"))
+        self.storage.delete(name)
+        self.assertTrue(self.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+        self.storage.delete(name)
+        self.assertFalse(self.exists(name))
+        self.assertFalse(MediaBlob.objects.exists())
+        # The next upload is stored again
+        self.assertEqual(
+            self.storage.save("uploads/c.png", ContentFile(b"image")), "uploads/c.png"
+        )
+        self.assertTrue(self.exists("uploads/c.png"))
+
+    def test_missing_copy_is_replaced(self):
+        name = self.storage.save("uploads/a.png", ContentFile(b"image"))
+        self.storage.save("uploads/a2.png", ContentFile(b"image"))
+        os.remove(os.path.join(self.root, name))
+        new_name = self.storage.save("uploads/b.png", ContentFile(b"image"))
+        self.assertEqual(new_name, "uploads/b.png")
+        self.assertTrue(self.exists(new_name))
+        blob = MediaBlob.objects.get()
+        self.assertEqual((blob.name, blob.refcount), (new_name, 1))
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class DedupeMediaCommandTests(MediaRootMixin, TestCase):
+    def dedupe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("dedupe_media", stdout=StringIO())
+
+    def test_folds_duplicates_and_repoints_posts(self):
+        self.write("uploads/photo.png", b"image")
+        self.write("uploads/photo_Xy12ab.png", b"image")
+        self.write("uploads/copy/photo.png", b"image")
+        self.write("uploads/single.png", b"single")
+        with_image = make_post(image="uploads/photo_Xy12ab.png")
+        with_link = make_post()
+        with_link.text = '<img src="/media/uploads/copy/photo.png">'
+        with_link.save()
+
+        self.dedupe()
+        self.assertTrue(self.exists("uploads/photo.png"))
+        self.assertFalse(self.exists("uploads/photo_Xy12ab.png"))
+        self.assertFalse(self.exists("uploads/copy/photo.png"))
+        with_image.refresh_from_db()
+        with_link.refresh_from_db()
+        self.assertEqual(with_image.image.name, "uploads/photo.png")
+        self.assertEqual(with_link.text, '<img src="/media/uploads/photo.png">')
+        self.assertEqual(
+            dict(MediaBlob.objects.values_list("name", "refcount")),
+            {"uploads/photo.png": 3, "uploads/single.png": 1},
+        )
+
+    def test_keeps_existing_refcounts(self):
+        # Two uploads through the storage, then a copy made outside of it
+        storage = DeduplicatingFileSystemStorage(location=self.root)
+        name = storage.save("uploads/a.png", ContentFile(b"image"))
+        storage.save("uploads/b.png", ContentFile(b"image"))
+        self.write("uploads/restored.png", b"image")
+
+        self.dedupe()
+        self.assertFalse(self.exists("uploads/restored.png"))
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 3)
+        # Running it again changes nothing
+        self.dedupe()
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 3)
+        for _ in range(2):
+            storage.delete(name)
+        self.assertTrue(self.exists(name))
+
+    def test_dry_run(self):
+        self.write("uploads/a.png", b"image")
+        self.write("uploads/b.png", b"image")
+        call_command("dedupe_media", "--dry-run", stdout=StringIO())
+        self.assertTrue(self.exists("uploads/b.png"))
+        self.assertFalse(MediaBlob.objects.exists())
+
+
+# ==============================
+# ORPHANED MEDIA
+# ==============================
+
+DAY = 86400
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class OrphanedMediaTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.quarantine = tmp.name
+        self.enterContext(override_settings(MEDIA_QUARANTINE_ROOT=self.quarantine))
+
+    def write(self, name, data=b"x", age=2 * DAY):
+        super().write(name, data)
+        mtime = time.time() - age
+        os.utime(os.path.join(self.root, name), (mtime, mtime))
+
+    def orphans(self, grace=DAY):
+        media_index.scan_media()
+        batches = media_index.find_orphans(grace)
+        return sorted(name for batch in batches for name in batch)
+
+    def test_unreferenced_old_files(self):
+        self.write("uploads/used.png")
+        self.write("uploads/orphan.png")
+        self.write("uploads/new.png", age=60)
+        make_post(image="uploads/used.png")
+        self.assertEqual(self.orphans(), ["uploads/orphan.png"])
+
+    def test_grace_period_counts_from_last_upload(self):
+        # An old file that a new upload was just deduplicated onto
+        self.write("uploads/reused.png")
+        self.write("uploads/orphan.png")
+        MediaBlob.objects.create(digest="a" * 64, name="uploads/reused.png", size=1)
+        MediaBlob.objects.create(
+            digest="b" * 64,
+            name="uploads/orphan.png",
+            size=1,
+            referenced_at=timezone.now() - timedelta(days=2),
+        )
+        self.assertEqual(self.orphans(), ["uploads/orphan.png"])
+
+    def test_thumbnails_follow_their_image(self):
+        self.write("uploads/used.png")
+        self.write("uploads/used_thumb.png")
+        self.write("uploads/gone_thumb.png")
+        post = make_post()
+        post.text = '<img src="/media/uploads/used.png">'
+        post.save()
+        self.assertEqual(self.orphans(), ["uploads/gone_thumb.png"])
+
+    def test_unchanged_directories_are_not_listed(self):
+        self.write("uploads/2025/a.png")
+        self.write("other/b.png")
+        for directory in ("uploads/2025", "uploads", "other", ""):
+            os.utime(os.path.join(self.root, directory), (1, 1))
+        self.assertEqual(media_index.scan_media(), (4, 4))
+        self.assertEqual(media_index.scan_media(), (4, 0))
+
+        # Only the directory a file was added to is listed again
+        self.write("uploads/2025/c.png")
+        self.assertEqual(media_index.scan_media(), (4, 1))
+        self.assertEqual(
+            sorted(MediaFile.objects.values_list("name", flat=True)),
+            ["other/b.png", "uploads/2025/a.png", "uploads/2025/c.png"],
+        )
+
+    def sweep(self, *args):
+        call_command("sweep_media", "--grace-hours=24", *args, stdout=StringIO())
+
+    def test_sweep_reports_only(self):
+        self.write("uploads/orphan.png")
+        self.sweep()
+        self.assertTrue(self.exists("uploads/orphan.png"))
+
+    def test_sweep_delete(self):
+        self.write("uploads/orphan.png")
+        self.write("uploads/used.png")
+        make_post(image="uploads/used.png")
+        self.sweep("--delete")
+        self.assertFalse(self.exists("uploads/orphan.png"))
+        self.assertTrue(self.exists("uploads/used.png"))
+        self.assertFalse(os.listdir(self.quarantine))
+        self.assertFalse(
+            MediaFile.objects.filter(name="uploads/orphan.png").exists()
+        )
+
+    def test_sweep_quarantine(self):
+        self.write("uploads/orphan.png", b"orphan")
+        MediaBlob.objects.create(
+            digest="a" * 64,
+            name="uploads/orphan.png",
+            size=6,
+            referenced_at=timezone.now() - timedelta(days=2),
+        )
+        self.sweep("--quarantine")
+        self.assertFalse(self.exists("uploads/orphan.png"))
+        with open(os.path.join(self.quarantine, "uploads/orphan.png"), "rb") as f:
+            self.assertEqual(f.read(), b"orphan")
+        # A new upload of the same content must not reuse the removed name
+        self.assertFalse(MediaBlob.objects.exists())
+
+
+# ==============================
+# VIEW ANALYTICS
+# ==============================
+
+
+# A zone with a half-hour offset: hours must still fold into local days
+@override_settings(CACHES=SHARED_CACHES, TIME_ZONE="Asia/Kolkata")
+class ViewAnalyticsTests(TestCase):
+    def setUp(self):
+        self.post = make_post()
+        self.aggregator = ViewAggregator(max_pending=1000, flush_interval=3600)
+
+    def buckets(self, granularity):
+        return dict(
+            PostViewBucket.objects.filter(granularity=granularity).values_list(
+                "bucket_start", "views"
+            )
+        )
+
+    def test_record_flush_and_compact(self):
+        now = timezone.now()
+        day = day_start(now - timedelta(days=4))
+        views = [
+            day + timedelta(hours=1),
+            day + timedelta(hours=1, minutes=30),
+            day + timedelta(hours=23, minutes=45),
+            day + timedelta(days=1, hours=2),
+            now,
+        ]
+        for when in views:
+            self.aggregator.record(self.post.pk, when)
+
+        # A failed write keeps the views for the next flush
+        with mock.patch("blog.analytics.write_view_batch", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.aggregator.flush()
+        self.assertEqual(self.aggregator.flush(), 5)
+        self.assertEqual(self.aggregator.flush(), 0)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 5)
+        self.assertTrue(TrendingScore.objects.filter(post=self.post).exists())
+        self.assertEqual(
+            self.buckets(PostViewBucket.HOUR),
+            {
+                day + timedelta(hours=1): 2,
+                day + timedelta(hours=23): 1,
+                day + timedelta(days=1, hours=2): 1,
+                hour_start(now): 1,
+            },
+        )
+
+        # Another flush adds to the existing rows
+        self.aggregator.record(self.post.pk, now)
+        self.aggregator.flush()
+        self.assertEqual(self.buckets(PostViewBucket.HOUR)[hour_start(now)], 2)
+
+        call_command("compact_view_buckets", "--keep-days=2", stdout=StringIO())
+        self.assertEqual(
+            self.buckets(PostViewBucket.DAY),
+            {day: 3, day_start(day + timedelta(days=1)): 1},
+        )
+        self.assertEqual(self.buckets(PostViewBucket.HOUR), {hour_start(now): 2})
@@ -0,0 +1,83 @@
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Exp, Greatest, Least, Ln
+from django.utils import timezone
+
+from .models import TrendingScore
+
+# ==============================
+# TRENDING / POPULAR POSTS
+# ==============================
+# Each event adds weight * 2 ** (age_of_event_since_EPOCH / half_life) to a
+# post's score. Newer events are worth exponentially more, which is the same
+# ranking as decaying every old event towards "now", but an update only ever
+# touches the row of the post the event belongs to.
+#
+# The sum is stored as its natural log so it never overflows:
+#   log(a + b) = max(la, lb) + ln(1 + exp(min(la, lb) - max(la, lb)))
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+WEIGHTS = {
+    "view": 1.0,
+    "reaction": 2.0,
+    "comment": 5.0,
+}
+
+
+def half_life_seconds():
+    return getattr(settings, "TRENDING_HALF_LIFE_HOURS", 24) * 3600
+
+
+def event_score(kind, when=None, count=1):
+    # Log-space contribution of `count` events of the given kind at `when`
+    when = when or timezone.now()
+    age = (when - EPOCH).total_seconds()
+    return math.log(WEIGHTS[kind] * count) + age * math.log(2) / half_life_seconds()
+
+
+def log_add(a, b):
+    # Python counterpart of the SQL expression used in record_event()
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def record_event(post_id, kind, count=1, when=None):
+    # Add an event to the post's score with a single atomic UPDATE
+    if count <= 0:
+        return
+    value = Value(event_score(kind, when, count), output_field=FloatField())
+    high = Greatest(F("score"), value)
+    low = Least(F("score"), value)
+    updated = TrendingScore.objects.filter(post_id=post_id).update(
+        score=high + Ln(Value(1.0) + Exp(low - high)),
+        updated_at=timezone.now(),
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            TrendingScore.objects.create(post_id=post_id, score=value.value)
+    except IntegrityError:
+        # Another request created the row first (or the post is gone)
+        record_event_if_exists(post_id, kind, count, when)
+
+
+def record_event_if_exists(post_id, kind, count=1, when=None):
+    if TrendingScore.objects.filter(post_id=post_id).exists():
+        record_event(post_id, kind, count, when)
+
+
+def popular_posts(limit=None):
+    # Top N published posts: one query on the score index
+    limit = limit or getattr(settings, "TRENDING_POSTS_LIMIT", 5)
+    return [
+        row.post
+        for row in TrendingScore.objects.select_related("post")
+        .filter(post__published_date__lte=timezone.now())
+        .order_by("-score")[:limit]
+    ]
@@ -3,12 +3,16 @@ from django.contrib import admin
 from django.contrib.auth import views as auth_views
 
 from django.urls import path
-from . import views
+from . import feeds, views
+from .metrics import metrics_view
+from .ratelimit import ratelimit
 
 
 # URL patterns for the blog app
 # Each path maps a URL to a view function in views.py
 # - The name argument allows reverse URL resolution in templates and redirects
+# - Public write endpoints are wrapped in ratelimit() (POST only, see
+#   blog/ratelimit.py); per_ip/per_session set the allowed rate per URL name
 
 
 urlpatterns = [
@@ -17,6 +21,14 @@ urlpatterns = [
     # Post detail and CRUD
     path("post/<int:pk>/", views.post_detail, name="post_detail"),
     path("post/new/", views.post_new, name="post_new"),
+    # Archive by month and by author (counts precomputed, blog/archive.py)
+    path("archive/", views.archive_index, name="archive_index"),
+    path("archive/<int:year>/<int:month>/", views.archive_month, name="archive_month"),
+    path(
+        "archive/author/<str:username>/", views.archive_author, name="archive_author"
+    ),
+    # Title autocomplete for the navbar search box (blog/autocomplete.py)
+    path("autocomplete/", views.post_autocomplete, name="post_autocomplete"),
     path("post/<int:pk>/edit/", views.post_edit, name="post_edit"),
     # Drafts, publish, and delete
     path("drafts/", views.post_draft_list, name="post_draft_list"),
@@ -24,17 +36,37 @@ urlpatterns = [
     path("post/<int:pk>/remove/", views.post_remove, name="post_remove"),
     # Comments: add, approve, remove, reply
     path(
-        "post/<int:pk>/comment/", views.add_comment_to_post, name="add_comment_to_post"
+        "post/<int:pk>/comment/",
+        ratelimit(views.add_comment_to_post, per_ip="10/m", per_session="5/m"),
+        name="add_comment_to_post",
     ),
+    # Lazy loading of further comment threads and replies (HTML fragments)
+    path("post/<int:pk>/comments/", views.post_comments, name="post_comments"),
+    path("comment/<int:pk>/replies/", views.comment_replies, name="comment_replies"),
     path("comment/<int:pk>/approve/", views.comment_approve, name="comment_approve"),
     path("comment/<int:pk>/remove/", views.comment_remove, name="comment_remove"),
     # Add a reply to an existing comment (AJAX or normal POST)
     path(
         "comment/<int:pk>/reply/",
-        views.add_reply_to_comment,
+        ratelimit(views.add_reply_to_comment, per_ip="10/m", per_session="5/m"),
         name="add_reply_to_comment",
     ),
     # Like/dislike endpoints for comments
-    path("comment/<int:pk>/like/", views.comment_like, name="comment_like"),
-    path("comment/<int:pk>/dislike/", views.comment_dislike, name="comment_dislike"),
+    path(
+        "comment/<int:pk>/like/",
+        ratelimit(views.comment_like, per_ip="60/m", per_session="30/m"),
+        name="comment_like",
+    ),
+    path(
+        "comment/<int:pk>/dislike/",
+        ratelimit(views.comment_dislike, per_ip="60/m", per_session="30/m"),
+        name="comment_dislike",
+    ),
+    # Sitemap (split into pages by post id) and feeds, cached (blog/feeds.py)
+    path("sitemap.xml", feeds.sitemap_index, name="sitemap"),
+    path("sitemap-<int:page>.xml", feeds.sitemap_page, name="sitemap_page"),
+    path("feed/atom/", feeds.feed, {"feed_format": "atom"}, name="feed_atom"),
+    path("feed/rss/", feeds.feed, {"feed_format": "rss"}, name="feed_rss"),
+    # Prometheus metrics of all workers (METRICS_ALLOWED_IPS only)
+    path("metrics/", metrics_view, name="metrics"),
 ]
@@ -1,31 +1,200 @@
+from datetime import date
+
+from django.conf import settings
+from django.db.models import (
+    CharField,
+    Count,
+    Exists,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Window,
+)
+from django.db.models.functions import RowNumber
 from django.shortcuts import redirect, render, get_object_or_404
 from django.utils import timezone
 from .models import Post, Comment
 from .forms import PostForm, CommentForm
+from . import archive
+from .analytics import record_view
+from .autocomplete import autocomplete
+from .trending import popular_posts
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.urls import reverse
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect
 
 # AJAX endpoints for liking/disliking comments
 from django.views.decorators.http import require_POST
 from django.http import JsonResponse
 
 
+# COMMENTS FRAGMENT – shared by post_detail and the AJAX comment endpoints
+def visible_comments(request, queryset):
+    # Guests only see approved comments whose ancestors are all approved:
+    # no unapproved comment of the same thread has a path that is a prefix
+    # of the comment's path
+    if request.user.is_authenticated:
+        return queryset
+    hidden_ancestor = (
+        Comment.objects.filter(root_id=OuterRef("root_id"), approved_comment=False)
+        .annotate(
+            descendant_path=ExpressionWrapper(
+                OuterRef("path"), output_field=CharField()
+            )
+        )
+        .filter(descendant_path__startswith=F("path"))
+    )
+    return queryset.filter(approved_comment=True).exclude(Exists(hidden_ancestor))
+
+
+def comments_context(request, post, before=None):
+    # One page of top-level threads (keyset pagination on the root id, newest
+    # first) with the first few replies of each thread. The page always costs
+    # three queries, however many comments the post has.
+    comments = visible_comments(request, post.comments.all())
+    page_size = settings.COMMENT_THREADS_PER_PAGE
+    preview = settings.COMMENT_REPLIES_PREVIEW
+
+    roots = comments.filter(depth=0)
+    if before:
+        roots = roots.filter(pk__lt=before)
+    roots = list(roots.order_by("-pk")[: page_size + 1])
+    next_cursor = roots[page_size - 1].pk if len(roots) > page_size else None
+    roots = roots[:page_size]
+    root_ids = [root.pk for root in roots]
+
+    # First `preview` replies of every thread on the page, in path order
+    replies = (
+        comments.filter(root_id__in=root_ids, depth__gt=0)
+        .annotate(
+            position=Window(
+                RowNumber(), partition_by=F("root_id"), order_by=F("path").asc()
+            )
+        )
+        .filter(position__lte=preview)
+        .order_by("path")
+    )
+    reply_counts = dict(
+        comments.filter(root_id__in=root_ids, depth__gt=0)
+        .order_by()
+        .values("root_id")
+        .annotate(n=Count("pk"))
+        .values_list("root_id", "n")
+    )
+
+    threads = {root.pk: {"comment": root, "replies": []} for root in roots}
+    for reply in replies:
+        threads[reply.root_id]["replies"].append(reply)
+    for root_id, thread in threads.items():
+        thread["reply_count"] = reply_counts.get(root_id, 0)
+        thread["more_replies"] = thread["reply_count"] - len(thread["replies"])
+        if thread["replies"]:
+            thread["after"] = thread["replies"][-1].path
+
+    return {
+        "post": post,
+        "user": request.user,
+        "threads": list(threads.values()),
+        "next_cursor": next_cursor,
+    }
+
+
+def render_comments(request, post):
+    return render(request, "blog/comments_list.html", comments_context(request, post))
+
+
+def cursor_param(request, name):
+    value = request.GET.get(name, "")
+    return int(value) if value.isdigit() else None
+
+
 # LIST VIEW – show published posts on the homepage
 def post_list(request):
-    posts = Post.objects.filter(published_date__lte=timezone.now()).order_by(
-        "-published_date"
+    # Cards show the stored summary, so the rich text is never loaded
+    posts = (
+        Post.objects.filter(published_date__lte=timezone.now())
+        .defer("text")
+        .order_by("-published_date", "-pk")[: settings.HOMEPAGE_POSTS]
     )
-    return render(request, "blog/post_list.html", {"posts": posts})
+    return render(
+        request,
+        "blog/post_list.html",
+        {
+            "posts": posts,
+            # Called by the template inside a {% cache %} fragment, so the
+            # ranking query only runs on a miss
+            "popular_posts": popular_posts,
+            "homepage_cache_timeout": settings.HOMEPAGE_CACHE_TIMEOUT,
+            "popular_cache_timeout": settings.TRENDING_CACHE_TIMEOUT,
+        },
+    )
+
+
+# ARCHIVE – months and authors with their post counts (blog/archive.py)
+def archive_index(request):
+    return render(request, "blog/archive_index.html", archive.archive_index())
+
+
+def archive_posts(request, title, posts, bucket):
+    # One page of a month/author archive; the count comes from the cached
+    # index, the page itself is one keyset query (?before=<cursor>)
+    page, next_cursor = archive.page_of_posts(posts, request.GET.get("before"))
+    if not page and request.GET.get("before") is None:
+        raise Http404("No posts in this archive.")
+    return render(
+        request,
+        "blog/archive_posts.html",
+        {
+            "title": title,
+            "posts": page,
+            "count": bucket["count"],
+            "next_cursor": next_cursor,
+        },
+    )
+
+
+def archive_month(request, year, month):
+    try:
+        first_day = date(year, month, 1)
+    except ValueError:
+        raise Http404("No such month.")
+    index = archive.archive_index()
+    bucket = next((b for b in index["months"] if b["month"] == first_day), None)
+    if bucket is None:
+        raise Http404("No posts in this month.")
+    posts = archive.bucket_posts(archive.ArchiveBucket.MONTH, first_day)
+    return archive_posts(request, f"{first_day:%B %Y}", posts, bucket)
+
+
+def archive_author(request, username):
+    index = archive.archive_index()
+    bucket = next((b for b in index["authors"] if b["username"] == username), None)
+    if bucket is None:
+        raise Http404("No posts by this author.")
+    posts = archive.bucket_posts(archive.ArchiveBucket.AUTHOR, bucket["author_id"])
+    return archive_posts(request, f"Posts by {username}", posts, bucket)
+
+
+# AUTOCOMPLETE – post titles for the navbar search (JSON, served from memory)
+def post_autocomplete(request):
+    query = request.GET.get("q", "")[:100]
+    results = [
+        {"title": title, "url": reverse("post_detail", args=[post_id])}
+        for post_id, title in autocomplete.search(query)
+    ]
+    response = JsonResponse({"results": results})
+    response["Cache-Control"] = "public, max-age=60"
+    return response
 
 
 # DETAIL VIEW – show a single post when its title is clicked
 def post_detail(request, pk):
     post = get_object_or_404(Post, pk=pk)
     if not request.user.is_authenticated:
-        post.increment_views()
-    return render(request, "blog/post_detail.html", {"post": post})
+        # Buffered in memory and written in batches (see blog/analytics.py)
+        record_view(post)
+    return render(request, "blog/post_detail.html", comments_context(request, post))
 
 
 # DRAFT LIST VIEW – show all posts that are drafts (not published)
@@ -45,6 +214,7 @@ def post_new(request):
             post.author = request.user
             if "publish_immediately" in request.POST:
                 post.published_date = timezone.now()
+                post.scheduled_date = None
                 post.save()
                 return redirect("post_list")
             else:
@@ -112,11 +282,7 @@ def add_comment_to_post(request, pk):
 
             # AJAX: If AJAX request, return only the comments list fragment
             if request.headers.get("x-requested-with") == "XMLHttpRequest":
-                return render(
-                    request,
-                    "blog/comments_list.html",
-                    {"post": post, "user": request.user},
-                )
+                return render_comments(request, post)
 
             # Add notification for all users after comment submission
             from django.contrib import messages
@@ -156,11 +322,7 @@ def comment_approve(request, pk):
     post = comment.post
     # AJAX: update comments section instantly
     if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        return render(
-            request,
-            "blog/comments_list.html",
-            {"post": post, "user": request.user},
-        )
+        return render_comments(request, post)
     return redirect("post_detail", pk=post.pk)
 
 
@@ -226,15 +388,8 @@ def comment_like(request, pk):
                 {"likes": comment.likes, "dislikes": comment.dislikes}
             )
 
-    # AJAX: allows the website to update the comments section without refreshing the entire page
-    if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        return render(
-            request,
-            "blog/comments_list.html",
-            {"post": comment.post, "user": request.user},
-        )
-
-    return redirect("post_detail", pk=comment.post.pk)
+    # New counts, shown by the like/dislike buttons (as for comment_dislike)
+    return result
 
 
 # DISLIKE COMMENT VIEW
@@ -292,11 +447,7 @@ def comment_dislike(request, pk):
 
     # AJAX: allows the website to update the comments section without refreshing the entire page
     if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        return render(
-            request,
-            "blog/comments_list.html",
-            {"post": comment.post, "user": request.user},
-        )
+        return render_comments(request, comment.post)
 
     return redirect("post_detail", pk=comment.post.pk)
 
@@ -311,13 +462,34 @@ def comment_remove(request, pk):
 
     # AJAX: allows the website to update the comments section without refreshing the entire page
     if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        return render(
-            request, "blog/comments_list.html", {"post": post, "user": request.user}
-        )
+        return render_comments(request, post)
 
     return HttpResponseRedirect(reverse("post_detail", args=[post.pk]))
 
 
+# COMMENT THREADS FRAGMENT – next page of top-level threads ("Show more comments")
+def post_comments(request, pk):
+    post = get_object_or_404(Post, pk=pk)
+    context = comments_context(request, post, before=cursor_param(request, "before"))
+    return render(request, "blog/comment_threads.html", context)
+
+
+# REPLIES FRAGMENT – next replies of a thread ("Show more replies")
+def comment_replies(request, pk):
+    root = get_object_or_404(Comment, pk=pk, depth=0)
+    after = request.GET.get("after", "")
+    page_size = settings.COMMENT_REPLIES_PAGE
+    remaining = visible_comments(
+        request, Comment.objects.filter(root=root, depth__gt=0, path__gt=after)
+    )
+    replies = list(remaining.order_by("path")[:page_size])
+    context = {"root": root, "replies": replies, "user": request.user}
+    if replies:
+        context["after"] = replies[-1].path
+        context["remaining"] = remaining.filter(path__gt=context["after"]).count()
+    return render(request, "blog/comment_replies.html", context)
+
+
 # ADD REPLY TO COMMENT VIEW – add a reply to a comment (AJAX or POST)
 from django.views.decorators.csrf import csrf_protect
 from django.http import JsonResponse
@@ -340,21 +512,17 @@ def add_reply_to_comment(request, pk):
             is_approved = (
                 request.user.is_authenticated if hasattr(request, "user") else False
             )
-            reply = Comment.objects.create(
+            # Create with the parent set so the thread path is built on insert
+            Comment.objects.create(
                 post=parent_comment.post,
+                parent=parent_comment,
                 author=author,
                 text=text,
                 approved_comment=is_approved,
             )
-            reply.parent = parent_comment
-            reply.save()
         # AJAX: If AJAX request, return updated comments list
         if request.headers.get("x-requested-with") == "XMLHttpRequest":
-            return render(
-                request,
-                "blog/comments_list.html",
-                {"post": parent_comment.post, "user": request.user},
-            )
+            return render_comments(request, parent_comment.post)
         # Fallback: redirect to post detail
         return redirect("post_detail", pk=parent_comment.post.pk)
     # Fallback: redirect to post detail if not POST
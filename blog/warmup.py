@@ -0,0 +1,206 @@
+import importlib
+import io
+import logging
+import os
+import time
+
+import django
+from django.conf import settings
+from django.db import connections
+from django.urls import NoReverseMatch, get_resolver, resolve, reverse
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# WORKER WARM-UP
+# ==============================
+# A fresh worker compiles templates, populates the URL resolvers, imports
+# the CKEditor/Pillow upload code and builds the title autocomplete index on
+# first use, and starts with cold caches, so the first requests after a
+# (rolling) deploy are slow. warm_up() does that work up front:
+#
+# - "manage.py warmup" primes the shared caches (homepage fragment, archive index,
+#   feeds) and reports the time of each phase;
+# - in a worker, set DJANGO_WARMUP=1 (mysite/wsgi.py and asgi.py call
+#   warm_up() after loading the application) or use the gunicorn hook,
+#   which runs once the worker has loaded the application:
+#
+#     # gunicorn.conf.py
+#     from blog.warmup import post_worker_init
+#
+# This module can be imported before Django is set up (gunicorn reads its
+# config first), so anything touching models or templates is imported
+# inside the functions. Warm-up never fails a worker: a phase that raises is
+# logged and skipped.
+
+# Imported lazily by ckeditor_uploader and the image field on first upload
+MODULES = [
+    "ckeditor_uploader.views",
+    "ckeditor_uploader.backends",
+    "ckeditor_uploader.utils",
+    "django.utils.feedgenerator",
+    "PIL.Image",
+]
+
+TOP_POSTS = 5
+
+
+def warm_imports():
+    loaded = 0
+    for module in MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+        loaded += 1
+    try:
+        from PIL import Image
+
+        Image.init()  # registers every image format plugin
+    except ImportError:
+        pass
+    return f"{loaded} modules"
+
+
+def warm_templates():
+    # Compile every template shipped with the blog app into the engine's
+    # cached loader (includes such as the SVG icons are separate entries)
+    from django.apps import apps
+    from django.template import engines
+
+    engine = engines["django"]
+    root = os.path.join(apps.get_app_config("blog").path, "templates")
+    count = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            name = os.path.relpath(os.path.join(dirpath, filename), root)
+            engine.get_template(name.replace(os.sep, "/"))
+            count += 1
+    return f"{count} templates"
+
+
+def warm_urls():
+    # Reverse every named URL (with placeholder arguments) and resolve the
+    # result, which populates the resolvers of every included URLconf
+    resolver = get_resolver()
+    names = [name for name in resolver.reverse_dict if isinstance(name, str)]
+    for namespace, (_, sub_resolver) in resolver.namespace_dict.items():
+        names += [
+            f"{namespace}:{name}"
+            for name in sub_resolver.reverse_dict
+            if isinstance(name, str)
+        ]
+    count = 0
+    for name in names:
+        try:
+            path = reverse(name)
+        except NoReverseMatch:
+            try:
+                path = reverse(name, args=[1])
+            except NoReverseMatch:
+                continue
+        resolve(path)
+        count += 1
+    return f"{count} URLs"
+
+
+def make_request(path, host):
+    # A plain GET request as a WSGI server would pass it to Django
+    from django.core.handlers.wsgi import WSGIRequest
+
+    return WSGIRequest(
+        {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": path,
+            "SCRIPT_NAME": "",
+            "QUERY_STRING": "",
+            "SERVER_NAME": host,
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": host,
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(),
+        }
+    )
+
+
+def warm_caches():
+    from django.contrib.auth.models import AnonymousUser
+    from django.core.handlers.base import BaseHandler
+    from django.template.loader import render_to_string
+
+    from .trending import popular_posts
+    from .views import comments_context
+
+    # Homepage (post cards fragment), archive index and feeds through the full
+    # middleware stack, as a guest
+    host = next(
+        (h for h in settings.ALLOWED_HOSTS if h != "*" and not h.startswith(".")),
+        "localhost",
+    )
+    handler = BaseHandler()
+    handler.load_middleware()
+    paths = [
+        reverse("post_list"),
+        reverse("archive_index"),
+        reverse("sitemap"),
+        reverse("feed_atom"),
+    ]
+    for path in paths:
+        response = handler.get_response(make_request(path, host))
+        if response.status_code != 200:
+            logger.warning("Warm-up request %s: %s", path, response.status_code)
+
+    # Detail pages of the most popular posts, rendered without going through
+    # the view so the warm-up isn't counted as a visit
+    request = make_request("/", host)
+    request.user = AnonymousUser()
+    posts = popular_posts(TOP_POSTS)
+    for post in posts:
+        render_to_string(
+            "blog/post_detail.html", comments_context(request, post), request
+        )
+    return f"{len(paths)} pages, {len(posts)} posts"
+
+
+def warm_autocomplete():
+    from .autocomplete import autocomplete
+
+    return f"{len(autocomplete.build())} titles"
+
+
+PHASES = [
+    ("imports", warm_imports),
+    ("templates", warm_templates),
+    ("urls", warm_urls),
+    ("caches", warm_caches),
+    ("autocomplete", warm_autocomplete),
+]
+
+
+def warm_up(phases=None):
+    # Run the warm-up phases; returns (phase, seconds, detail) tuples
+    report = []
+    for name, phase in PHASES:
+        if phases and name not in phases:
+            continue
+        started = time.monotonic()
+        try:
+            detail = phase()
+        except Exception:
+            logger.exception("Warm-up phase %s failed", name)
+            detail = "failed"
+        elapsed = time.monotonic() - started
+        report.append((name, elapsed, detail))
+        logger.info("Warm-up %s: %.3fs (%s)", name, elapsed, detail)
+    # Connections opened here must not be shared with forked workers
+    connections.close_all()
+    return report
+
+
+def post_worker_init(worker):
+    # gunicorn hook, see above (django.setup() is a no-op once the
+    # application has been loaded)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    django.setup()
+    warm_up()
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# Optional warm-up of each worker before it serves traffic (see blog/warmup.py)
+if os.environ.get('DJANGO_WARMUP') == '1':
+    from blog.warmup import warm_up
+
+    warm_up()
@@ -41,6 +41,15 @@ ALLOWED_HOSTS = ["localhost", "127.0.0.1", ".pythonanywhere.com"]
 # Media files (uploads)
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Where "manage.py sweep_media --quarantine" moves orphaned uploads; outside
+# MEDIA_ROOT, so quarantined files are no longer public
+MEDIA_QUARANTINE_ROOT = BASE_DIR / "media-quarantine"
+
+# Let the web server send media files: None (stream from Django),
+# "x-accel-redirect" (nginx, internal location MEDIA_ACCEL_REDIRECT_PREFIX
+# aliased to MEDIA_ROOT) or "x-sendfile" (Apache mod_xsendfile, lighttpd)
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = "/protected-media/"
 
 INSTALLED_APPS = [
     "blog",
@@ -55,6 +64,7 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    "blog.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -62,8 +72,27 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "blog.profiling.ProfilingMiddleware",
 ]
 
+# Request profiler (blog/profiling.py): staff can profile a request with the
+# "X-Profile: 1" header or "?profile"; additionally every N-th request of a
+# worker is profiled (0 = never). Profiles are listed in the admin.
+PROFILING_SAMPLE_EVERY = 0
+PROFILING_KEEP = 200
+
+# Metrics (blog/metrics.py): each worker writes its totals to METRICS_DIR at
+# most every METRICS_FLUSH_INTERVAL seconds; /metrics/ serves the sum of all
+# workers in the Prometheus text format to METRICS_ALLOWED_IPS only
+METRICS_DIR = BASE_DIR / "metrics"
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+
+# Title autocomplete (blog/autocomplete.py): most viewed titles kept in each
+# worker's index, and how often it is re-ranked to pick up new view counts
+AUTOCOMPLETE_MAX_TITLES = 100000
+AUTOCOMPLETE_REFRESH_INTERVAL = 600
+
 ROOT_URLCONF = "mysite.urls"
 
 TEMPLATES = [
@@ -96,6 +125,68 @@ DATABASES = {
 }
 
 
+# Cache
+# A bounded in-process LRU in front of a cache shared by all workers,
+# see blog/cache.py. Use a database cache ("createcachetable") or memcached/redis
+# for the shared tier when the workers run on several machines.
+
+CACHES = {
+    "default": {
+        "BACKEND": "blog.cache.TwoTierCache",
+        "LOCATION": "shared",
+        "OPTIONS": {
+            "LOCAL_MAX_ENTRIES": 500,
+            "LOCAL_TIMEOUT": 60,
+            "STAMP_CHECK_INTERVAL": 1,
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+        "TIMEOUT": 300,
+    },
+}
+
+# Seconds the homepage post cards stay cached. They are dropped on post/comment
+# changes and when a scheduled post goes live ("manage.py publish_scheduled"),
+# so only view counters can lag behind this long.
+HOMEPAGE_CACHE_TIMEOUT = 3600
+
+# Seconds the "Popular now" list stays cached: its ranking moves with every
+# view, so it is refreshed more often than the post cards
+TRENDING_CACHE_TIMEOUT = 300
+
+# Newest posts shown on the homepage; older ones are reached through the
+# archive pages (blog/archive.py), ARCHIVE_PAGE_SIZE posts per page. The
+# archive index is cached until a post is published, moved or removed.
+HOMEPAGE_POSTS = 30
+ARCHIVE_PAGE_SIZE = 20
+ARCHIVE_CACHE_TIMEOUT = 86400
+
+# sitemap.xml / feeds (blog/feeds.py): post ids per sitemap page, items per
+# feed and a safety-net timeout for the cached documents (they are dropped
+# whenever a published post changes)
+SITEMAP_PAGE_SIZE = 5000
+FEED_ITEMS = 20
+FEEDS_CACHE_TIMEOUT = 86400
+
+
+# Comment section paging: top-level threads per page, replies shown with
+# each thread, and replies fetched per "Show more replies" click
+COMMENT_THREADS_PER_PAGE = 10
+COMMENT_REPLIES_PREVIEW = 3
+COMMENT_REPLIES_PAGE = 20
+
+
+# Rate limiting of public write endpoints (limits are set in blog/urls.py).
+# Buckets live in the shared cache; enable X-Forwarded-For only behind a
+# trusted proxy. Writes are shed with 503 while the average write latency
+# of any worker is above LOAD_SHED_WRITE_LATENCY_MS (0 disables shedding).
+RATELIMIT_CACHE = "shared"
+RATELIMIT_TRUST_X_FORWARDED_FOR = False
+LOAD_SHED_WRITE_LATENCY_MS = 500
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -131,6 +222,18 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "static"
 
+# collectstatic writes content-hashed copies plus .gz/.br variants
+# (blog/storage.py); install "brotli" to get the .br files as well
+STORAGES = {
+    # Uploads: identical files are stored once (blog/storage.py)
+    "default": {
+        "BACKEND": "blog.storage.DeduplicatingFileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "blog.storage.CompressedManifestStaticFilesStorage",
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
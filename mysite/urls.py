@@ -47,9 +47,19 @@ urlpatterns = [
     path("accounts/reset/done/", auth_views.PasswordResetCompleteView.as_view(template_name="registration/password_reset_complete.html"), name="password_reset_complete"),
 ]
 
-# Serve media files in development
+# Uploaded media: streamed with Range/ETag support, or handed off to the web
+# server via X-Accel-Redirect/X-Sendfile (MEDIA_SENDFILE, see blog/serve.py)
 from django.conf import settings
-from django.conf.urls.static import static
+from django.urls import re_path
+from blog.serve import media_file, static_file
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns += [
+    re_path(r"^%s(?P<path>.+)$" % settings.MEDIA_URL.lstrip("/"), media_file),
+]
+
+if not settings.DEBUG:
+    # Collected static files: hashed names + precompressed variants
+    # (run "collectstatic" first, see blog/storage.py and blog/serve.py)
+    urlpatterns += [
+        re_path(r"^%s(?P<path>.+)$" % settings.STATIC_URL.lstrip("/"), static_file),
+    ]